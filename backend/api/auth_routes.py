@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException
+from pydantic import TypeAdapter
 from sqlalchemy.orm import Session
 
 from auth import (
@@ -15,10 +16,11 @@ from database import User, get_db
 
 
 router = APIRouter(prefix="/auth", tags=["Autenticação"])
+USER_ADAPTER = TypeAdapter(UserResponse)
 
 
 @router.post("/register", response_model=Token)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+def register(user_data: UserCreate, db: Session = Depends(get_db)):
     user = create_user(db, user_data)
     access_token = create_access_token(
         data={"sub": str(user.id), "email": user.email, "role": user.role}
@@ -26,12 +28,12 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
     return Token(
         access_token=access_token,
         token_type="bearer",
-        user=UserResponse.model_validate(user),
+        user=USER_ADAPTER.validate_python(user, from_attributes=True),
     )
 
 
 @router.post("/login", response_model=Token)
-async def login(user_data: UserLogin, db: Session = Depends(get_db)):
+def login(user_data: UserLogin, db: Session = Depends(get_db)):
     user = authenticate_user(db, user_data.email, user_data.password)
     if not user:
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
@@ -41,11 +43,11 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     return Token(
         access_token=access_token,
         token_type="bearer",
-        user=UserResponse.model_validate(user),
+        user=USER_ADAPTER.validate_python(user, from_attributes=True),
     )
 
 
 @router.get("/me", response_model=UserResponse)
-async def get_me(current_user: User = Depends(get_current_user)):
-    return UserResponse.model_validate(current_user)
+def get_me(current_user: User = Depends(get_current_user)):
+    return USER_ADAPTER.validate_python(current_user, from_attributes=True)
 
@@ -1,53 +1,82 @@
 from datetime import datetime, timedelta
 
 from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy import func
+from sqlalchemy import Integer, case, func, literal_column
 from sqlalchemy.orm import Session
 
 from auth import get_current_teacher
 from database import AttentionMetric, ClassSession, User, get_db
 from realtime.socket_handlers import room_attention_data, rooms
+from services.dashboard_cache import get_cached_dashboard, set_cached_dashboard
 
 router = APIRouter(prefix="/dashboard", tags=["Dashboard"])
 
 
+def _minute_bucket(db: Session):
+    """
+    Expressão inteira (epoch // 60) usada para agrupar métricas por minuto.
+    Agrupar por inteiro evita formatar strings no banco para cada linha.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        epoch = func.extract("epoch", func.date_trunc("minute", AttentionMetric.timestamp))
+    else:
+        epoch = func.strftime("%s", AttentionMetric.timestamp)
+    return (epoch.cast(Integer) // 60).label("bucket")
+
+
 @router.get("/session/{room_code}")
-async def get_session_dashboard(
+def get_session_dashboard(
     room_code: str,
     current_user: User = Depends(get_current_teacher),
     db: Session = Depends(get_db),
 ):
+    cached = get_cached_dashboard(room_code)
+    if cached is not None:
+        return cached
+
     session = db.query(ClassSession).filter(ClassSession.room_code == room_code).first()
     if not session:
         raise HTTPException(status_code=404, detail="Sessão não encontrada")
 
-    attention_data = room_attention_data.get(room_code, {})
-    room_users = rooms.get(room_code, {})
+    # Esta rota roda no threadpool enquanto os handlers do socketio alteram
+    # os dicionários no event loop: copia antes de iterar (cópias atômicas).
+    attention_data = dict(room_attention_data.get(room_code, {}))
+    room_users = list(rooms.get(room_code, {}).items())
 
     participants_info = []
-    for user_id, user_info in room_users.items():
-        user_attention = attention_data.get(user_id, {})
+    attentive_count = inattentive_count = 0
+    for user_id, user_info in room_users:
+        user_attention = attention_data.get(user_id)
+        if user_attention:
+            is_attentive = user_attention.get("is_attentive")
+            confidence = user_attention.get("confidence", 0)
+            prob_attentive = user_attention.get("prob_attentive", 0)
+            prob_inattentive = user_attention.get("prob_inattentive", 0)
+            last_update = user_attention.get("timestamp")
+        else:
+            is_attentive = last_update = None
+            confidence = prob_attentive = prob_inattentive = 0
+
+        if is_attentive is True:
+            attentive_count += 1
+        elif is_attentive is False:
+            inattentive_count += 1
+
         participants_info.append(
             {
                 "id": user_id,
                 "name": user_info.get("name", "Anônimo"),
-                "is_attentive": user_attention.get("is_attentive"),
-                "confidence": user_attention.get("confidence", 0),
-                "prob_attentive": user_attention.get("prob_attentive", 0),
-                "prob_inattentive": user_attention.get("prob_inattentive", 0),
-                "last_update": user_attention.get("timestamp"),
+                "is_attentive": is_attentive,
+                "confidence": confidence,
+                "prob_attentive": prob_attentive,
+                "prob_inattentive": prob_inattentive,
+                "last_update": last_update,
             }
         )
 
     total = len(participants_info)
-    attentive_count = sum(
-        1 for p in participants_info if p["is_attentive"] is True
-    )
-    inattentive_count = sum(
-        1 for p in participants_info if p["is_attentive"] is False
-    )
 
-    return {
+    payload = {
         "session": {
             "id": session.id,
             "name": session.name,
@@ -62,10 +91,12 @@ async def get_session_dashboard(
         },
         "participants": participants_info,
     }
+    set_cached_dashboard(room_code, payload)
+    return payload
 
 
 @router.get("/session/{room_code}/history")
-async def get_session_history(
+def get_session_history(
     room_code: str,
     minutes: int = Query(30, description="Minutes of history to retrieve"),
     current_user: User = Depends(get_current_teacher),
@@ -76,9 +107,10 @@ async def get_session_history(
         raise HTTPException(status_code=404, detail="Sessão não encontrada")
 
     since = datetime.utcnow() - timedelta(minutes=minutes)
+    bucket = _minute_bucket(db)
     metrics = (
         db.query(
-            func.strftime("%Y-%m-%d %H:%M", AttentionMetric.timestamp).label("minute"),
+            bucket,
             func.avg(AttentionMetric.prob_attentive).label("avg_attentive"),
             func.count(AttentionMetric.id).label("count"),
         )
@@ -86,15 +118,16 @@ async def get_session_history(
             AttentionMetric.session_id == session.id,
             AttentionMetric.timestamp >= since,
         )
-        .group_by(func.strftime("%Y-%m-%d %H:%M", AttentionMetric.timestamp))
-        .order_by("minute")
+        # Agrupa/ordena pelo rótulo: a expressão é calculada só no SELECT
+        .group_by(literal_column(bucket.name))
+        .order_by(literal_column(bucket.name))
         .all()
     )
 
     return {
         "history": [
             {
-                "minute": m.minute,
+                "minute": datetime.utcfromtimestamp(m.bucket * 60).strftime("%Y-%m-%d %H:%M"),
                 "avg_attention": round(float(m.avg_attentive) * 100, 1),
                 "data_points": m.count,
             }
@@ -104,7 +137,7 @@ async def get_session_history(
 
 
 @router.get("/user/{user_id}/stats")
-async def get_user_stats(
+def get_user_stats(
     user_id: int,
     current_user: User = Depends(get_current_teacher),
     db: Session = Depends(get_db),
@@ -113,23 +146,17 @@ async def get_user_stats(
     if not user:
         raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
-    total_metrics = (
-        db.query(AttentionMetric).filter(AttentionMetric.user_id == user_id).count()
-    )
-    attentive_metrics = (
-        db.query(AttentionMetric)
-            .filter(
-                AttentionMetric.user_id == user_id,
-                AttentionMetric.is_attentive.is_(True),
-            )
-            .count()
-    )
-    avg_confidence = (
-        db.query(func.avg(AttentionMetric.confidence))
+    total_metrics, attentive_metrics, avg_confidence = (
+        db.query(
+            func.count(AttentionMetric.id),
+            func.sum(case((AttentionMetric.is_attentive.is_(True), 1), else_=0)),
+            func.avg(AttentionMetric.confidence),
+        )
         .filter(AttentionMetric.user_id == user_id)
-        .scalar()
-        or 0
+        .one()
     )
+    attentive_metrics = attentive_metrics or 0
+    avg_confidence = avg_confidence or 0
 
     return {
         "user": {
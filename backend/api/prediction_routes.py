@@ -1,17 +1,39 @@
-import io
+from collections import namedtuple
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional
 
-import torch
 from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
 from fastapi.responses import JSONResponse
-from PIL import Image
 from sqlalchemy.orm import Session
 
-from database import AttentionMetric, ClassSession, get_db
+from core.config import get_model_config
+from database import ClassSession, get_db
+from services.attention_model import decode_frame
 
 router = APIRouter(tags=["Predição"])
 
+# Tamanho máximo do frame enviado (2MB sobra para um frame de webcam)
+MAX_FRAME_BYTES = 2 * 1024 * 1024
+
+PredictContext = namedtuple(
+    "PredictContext", "classes classes_lower attentive_label_lower"
+)
+
+
+def _build_predict_context(config: Dict[str, Any]) -> PredictContext:
+    classes = config["classes"]
+    return PredictContext(
+        classes=classes,
+        classes_lower=[str(c).lower() for c in classes],
+        attentive_label_lower=str(config.get("attentive_label") or "").lower(),
+    )
+
+
+PREDICT_CTX = _build_predict_context(get_model_config())
+
+# room_code -> ClassSession.id (evictado em end_session)
+SESSION_ID_CACHE: Dict[str, int] = {}
+
 
 @router.post("/predict")
 async def predict(
@@ -25,46 +47,52 @@ async def predict(
         raise HTTPException(status_code=400, detail="Arquivo deve ser uma imagem")
 
     app_state = request.app.state
-    model = app_state.model
     transform = app_state.transform
-    config = app_state.model_config
-    device = app_state.device
-
-    contents = await file.read()
-    image = Image.open(io.BytesIO(contents)).convert("RGB")
-    img_tensor = transform(image).unsqueeze(0).to(device)
-
-    with torch.no_grad():
-        output = model(img_tensor)
-        prob = torch.softmax(output, dim=1)
-        pred_class = prob.argmax(1).item()
-        confidence = prob[0][pred_class].item()
-        predicted_label = config["classes"][pred_class]
-
-    prob_attentive = float(prob[0][0])
-    prob_inattentive = (
-        float(prob[0][1]) if len(prob[0]) > 1 else 1 - prob_attentive
-    )
 
-    attentive_label = config.get("attentive_label")
-    if attentive_label:
-        atento = str(predicted_label).lower() == str(attentive_label).lower()
+    # Lê no máximo um byte além do limite, sem carregar uploads enormes
+    data = await file.read(MAX_FRAME_BYTES + 1)
+    if len(data) > MAX_FRAME_BYTES:
+        raise HTTPException(status_code=413, detail="Imagem muito grande")
+
+    # Decodifica e pré-processa como tensor (na GPU, quando disponível)
+    try:
+        frame = decode_frame(data, app_state.device)
+    except (RuntimeError, ValueError):
+        raise HTTPException(status_code=400, detail="Imagem inválida")
+    img_tensor = transform(frame)
+
+    probs = (await app_state.batcher.predict(img_tensor)).tolist()
+    pred_class = max(range(len(probs)), key=probs.__getitem__)
+    confidence = probs[pred_class]
+    predicted_label = PREDICT_CTX.classes[pred_class]
+
+    prob_attentive = probs[0]
+    prob_inattentive = probs[1] if len(probs) > 1 else 1 - prob_attentive
+
+    predicted_lower = PREDICT_CTX.classes_lower[pred_class]
+    if PREDICT_CTX.attentive_label_lower:
+        atento = predicted_lower == PREDICT_CTX.attentive_label_lower
     else:
-        atento = (pred_class == 0) or ("aten" in str(predicted_label).lower())
+        atento = (pred_class == 0) or ("aten" in predicted_lower)
 
     if room_code and user_id:
-        session = db.query(ClassSession).filter(ClassSession.room_code == room_code).first()
-        if session:
-            metric = AttentionMetric(
-                user_id=user_id,
-                session_id=session.id,
-                is_attentive=bool(atento),
-                confidence=confidence,
-                prob_attentive=prob_attentive,
-                prob_inattentive=prob_inattentive,
+        session_id = SESSION_ID_CACHE.get(room_code)
+        if session_id is None:
+            session = db.query(ClassSession).filter(ClassSession.room_code == room_code).first()
+            if session:
+                session_id = SESSION_ID_CACHE[room_code] = session.id
+        if session_id is not None:
+            app_state.metric_buffer.add(
+                {
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "timestamp": datetime.utcnow(),
+                    "is_attentive": bool(atento),
+                    "confidence": confidence,
+                    "prob_attentive": prob_attentive,
+                    "prob_inattentive": prob_inattentive,
+                }
             )
-            db.add(metric)
-            db.commit()
 
     app_state.request_count += 1
 
@@ -75,13 +103,9 @@ async def predict(
             "classe": predicted_label,
             "pred_class_index": int(pred_class),
             "confianca": round(float(confidence), 4),
-            "probabilidades": {
-                config["classes"][i]: round(float(prob[0][i]), 4)
-                for i in range(len(config["classes"]))
-            },
+            "probabilidades": {c: round(p, 4) for c, p in zip(PREDICT_CTX.classes, probs)},
             "percentuais": {
-                config["classes"][i]: f"{round(float(prob[0][i]) * 100, 1)}%"
-                for i in range(len(config["classes"]))
+                c: f"{round(p * 100, 1)}%" for c, p in zip(PREDICT_CTX.classes, probs)
             },
             "prob_atento": round(prob_attentive * 100, 1),
             "prob_desatento": round(prob_inattentive * 100, 1),
@@ -1,3 +1,4 @@
+import time
 from datetime import datetime
 
 from fastapi import APIRouter, Request
@@ -8,6 +9,17 @@ from core.config import get_model_config
 router = APIRouter(tags=["Status"])
 MODEL_CONFIG = get_model_config()
 
+# Timestamp do /health recalculado no máximo uma vez por segundo
+_health_ts = {"at": float("-inf"), "value": ""}
+
+
+def _health_timestamp() -> str:
+    now = time.monotonic()
+    if now - _health_ts["at"] >= 1.0:
+        _health_ts["at"] = now
+        _health_ts["value"] = datetime.now().isoformat()
+    return _health_ts["value"]
+
 
 @router.get("/")
 def root(request: Request):
@@ -33,6 +45,6 @@ def health(request: Request):
         "status": "healthy",
         "device": device,
         "model_loaded": True,
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": _health_timestamp(),
     }
 
@@ -1,39 +1,51 @@
-import random
+import secrets
 import string
 from datetime import datetime
 from typing import Dict
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
+from api.prediction_routes import SESSION_ID_CACHE
 from auth import get_current_teacher, get_current_user
 from database import ClassSession, SessionParticipant, User, get_db
 
 router = APIRouter(prefix="/sessions", tags=["Sessões"])
 
+ROOM_CODE_ALPHABET = string.ascii_uppercase + string.digits
+ROOM_CODE_MAX_ATTEMPTS = 5
 
-def _generate_room_code(length: int = 6) -> str:
-    return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+
+def _generate_room_code(length: int = 8) -> str:
+    return "".join(secrets.choice(ROOM_CODE_ALPHABET) for _ in range(length))
 
 
 @router.post("/create")
-async def create_session(
+def create_session(
     name: str = Query(..., description="Nome da sessão/aula"),
     current_user: User = Depends(get_current_teacher),
     db: Session = Depends(get_db),
 ):
-    room_code = _generate_room_code()
-    while db.query(ClassSession).filter(ClassSession.room_code == room_code).first():
-        room_code = _generate_room_code()
-
-    session = ClassSession(
-        room_code=room_code,
-        name=name,
-        teacher_id=current_user.id,
-        is_active=True,
-    )
-    db.add(session)
-    db.commit()
+    # A restrição UNIQUE de room_code é a verificação de colisão
+    for _ in range(ROOM_CODE_MAX_ATTEMPTS):
+        session = ClassSession(
+            room_code=_generate_room_code(),
+            name=name,
+            teacher_id=current_user.id,
+            is_active=True,
+        )
+        db.add(session)
+        try:
+            db.commit()
+            break
+        except IntegrityError:
+            db.rollback()
+    else:
+        raise HTTPException(
+            status_code=500, detail="Não foi possível gerar um código de sala único"
+        )
     db.refresh(session)
 
     return {
@@ -48,7 +60,7 @@ async def create_session(
 
 
 @router.get("/active")
-async def get_active_sessions(
+def get_active_sessions(
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -58,15 +70,17 @@ async def get_active_sessions(
             ClassSession.is_active.is_(True),
         ).all()
     else:
-        participations = db.query(SessionParticipant).filter(
-            SessionParticipant.user_id == current_user.id,
-            SessionParticipant.left_at.is_(None),
-        ).all()
-        session_ids = [p.session_id for p in participations] or [0]
-        sessions = db.query(ClassSession).filter(
-            ClassSession.id.in_(session_ids),
-            ClassSession.is_active.is_(True),
-        ).all()
+        sessions = (
+            db.query(ClassSession)
+            .join(SessionParticipant, SessionParticipant.session_id == ClassSession.id)
+            .filter(
+                SessionParticipant.user_id == current_user.id,
+                SessionParticipant.left_at.is_(None),
+                ClassSession.is_active.is_(True),
+            )
+            .distinct()
+            .all()
+        )
 
     from realtime.socket_handlers import rooms  # lazy import
 
@@ -91,25 +105,27 @@ async def end_session(
     current_user: User = Depends(get_current_teacher),
     db: Session = Depends(get_db),
 ):
-    session = (
+    now = datetime.utcnow()
+    updated = (
         db.query(ClassSession)
         .filter(
             ClassSession.room_code == room_code,
             ClassSession.teacher_id == current_user.id,
         )
-        .first()
+        .update({"is_active": False, "ended_at": now}, synchronize_session=False)
     )
 
-    if not session:
+    if not updated:
+        db.rollback()
         raise HTTPException(status_code=404, detail="Sessão não encontrada")
 
-    session.is_active = False
-    session.ended_at = datetime.utcnow()
+    session_ids = select(ClassSession.id).where(ClassSession.room_code == room_code)
     db.query(SessionParticipant).filter(
-        SessionParticipant.session_id == session.id,
+        SessionParticipant.session_id.in_(session_ids.scalar_subquery()),
         SessionParticipant.left_at.is_(None),
-    ).update({"left_at": datetime.utcnow()})
+    ).update({"left_at": now}, synchronize_session=False)
     db.commit()
+    SESSION_ID_CACHE.pop(room_code, None)
 
     sio = getattr(request.app.state, "sio")
     await sio.emit("session-ended", {"room_code": room_code}, room=room_code)
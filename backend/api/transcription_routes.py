@@ -1,5 +1,4 @@
-import os
-import tempfile
+import asyncio
 from datetime import datetime
 from typing import Optional
 
@@ -8,7 +7,7 @@ from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 
 from database import ClassSession, Transcript, get_db
-from services.transcription import get_whisper_model
+from services.transcription import WHISPER_POOL, decode_audio, transcribe
 
 router = APIRouter(prefix="/transcribe", tags=["Transcrição"])
 
@@ -20,49 +19,19 @@ async def transcribe_audio(
     user_id: Optional[str] = Form(None),
     db: Session = Depends(get_db),
 ):
-    temp_input_path = None
-    temp_wav_path = None
-
     try:
         if not file.content_type.startswith("audio/"):
             raise HTTPException(status_code=400, detail="Arquivo deve ser de áudio")
 
         contents = await file.read()
-        ext_map = {
-            "audio/webm": ".webm",
-            "audio/ogg": ".ogg",
-            "audio/mp3": ".mp3",
-            "audio/mpeg": ".mp3",
-            "audio/wav": ".wav",
-            "audio/x-wav": ".wav",
-        }
-        file_ext = ext_map.get(file.content_type, ".webm")
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_input:
-            temp_input.write(contents)
-            temp_input_path = temp_input.name
-
         try:
-            from pydub import AudioSegment
-
-            if file_ext == ".webm":
-                audio = AudioSegment.from_file(temp_input_path, format="webm")
-            elif file_ext == ".ogg":
-                audio = AudioSegment.from_ogg(temp_input_path)
-            elif file_ext in [".mp3"]:
-                audio = AudioSegment.from_mp3(temp_input_path)
-            else:
-                audio = AudioSegment.from_file(temp_input_path)
+            audio = await asyncio.to_thread(decode_audio, contents)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
 
-            temp_wav_path = temp_input_path.replace(file_ext, ".wav")
-            audio.export(temp_wav_path, format="wav")
-        except ImportError:
-            temp_wav_path = temp_input_path
-        except Exception:
-            temp_wav_path = temp_input_path
-
-        model = get_whisper_model()
-        result = model.transcribe(temp_wav_path, language="pt", fp16=False)
+        result = await asyncio.get_running_loop().run_in_executor(
+            WHISPER_POOL, transcribe, audio
+        )
         transcribed_text = result["text"].strip()
 
         if room_code and user_id and transcribed_text:
@@ -102,13 +71,3 @@ async def transcribe_audio(
                 "timestamp": datetime.now().isoformat(),
             },
         )
-    finally:
-        if temp_input_path and os.path.exists(temp_input_path):
-            os.unlink(temp_input_path)
-        if (
-            temp_wav_path
-            and temp_wav_path != temp_input_path
-            and os.path.exists(temp_wav_path)
-        ):
-            os.unlink(temp_wav_path)
-
@@ -2,9 +2,19 @@
 Assistente de IA com LangChain usando FAISS
 Usa UnstructuredFileLoader para extração universal de arquivos
 """
+import hashlib
+import json
+import math
 import os
-from typing import List, Dict, Optional
+import pickle
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Dict, Optional
 from datetime import datetime
+from sqlalchemy import lambda_stmt, select
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 import logging
@@ -23,16 +33,39 @@ try:
     from langchain_community.embeddings import HuggingFaceEmbeddings
     from langchain.chains import ConversationalRetrievalChain
     from langchain.schema import Document
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_core.embeddings import Embeddings
 
     # Carregador universal de documentos
     from langchain_community.document_loaders import UnstructuredFileLoader
 
+    import faiss
+    import numpy as np
+
     LANGCHAIN_DISPONIVEL = True
 except ImportError as e:
     logger.warning(f"LangChain não disponível: {e}")
     LANGCHAIN_DISPONIVEL = False
 
-from database import AIContext, AIConversation
+try:
+    # Backend ONNX Runtime (opcional) para o modelo de embeddings
+    from optimum.onnxruntime import (
+        ORTModelForFeatureExtraction,
+        ORTOptimizer,
+        ORTQuantizer,
+    )
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+    from transformers import AutoTokenizer
+
+    ONNX_DISPONIVEL = True
+except ImportError:
+    ONNX_DISPONIVEL = False
+
+from sqlalchemy.exc import IntegrityError
+
+from database import AIContext, AIConversation, EmbeddingCache, SessionLocal
 
 # Chave API do Groq 
 CHAVE_API_GROQ = os.getenv("GROQ_API_KEY")
@@ -44,6 +77,13 @@ if not CHAVE_API_GROQ:
 DIRETORIO_VECTORSTORE = "./faiss_vectorstores"
 os.makedirs(DIRETORIO_VECTORSTORE, exist_ok=True)
 
+# Texto já extraído dos arquivos, indexado pelo sha256 do conteúdo
+DIRETORIO_CACHE_EXTRACAO = "./cache/extracted"
+os.makedirs(DIRETORIO_CACHE_EXTRACAO, exist_ok=True)
+
+
+# Máximo de arquivos processados em paralelo
+MAX_THREADS_ARQUIVOS = 8
 
 # Configuração do text splitter
 CHUNK_SIZE = 1000
@@ -59,11 +99,163 @@ NUM_DOCUMENTOS_RELEVANTES = 4
 LIMITE_HISTORICO_CHAT = 10
 MAX_FONTES_EXIBIDAS = 3
 
+# Prompt da resposta em streaming (sem a etapa extra de reformular a pergunta)
+PROMPT_SISTEMA_STREAMING = (
+    "Você é um assistente de estudos. Responda à pergunta do aluno usando "
+    "os trechos dos materiais da aula abaixo. Se a resposta não estiver nos "
+    "materiais, diga que não sabe.\n\n{contexto}"
+)
+# Enviado quando o stream do LLM falha depois que a resposta já começou
+# (o status 200 já foi enviado; o cliente precisa de um sinal no corpo)
+MARCADOR_ERRO_STREAMING = "\n\n[ERRO] A resposta foi interrompida. Tente novamente."
+
+# Configuração do índice FAISS
+MIN_CHUNKS_IVF = 1000
+MIN_CHUNKS_PQ = 10000
+NPROBE_FAISS = 8
+
+# Vectorstores mantidos em memória (LRU por sessão)
+MAX_VECTORSTORES_EM_CACHE = 32
+
 # Modelo de embeddings
 MODELO_EMBEDDINGS = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
+# Backend de embeddings: "torch" (HuggingFaceEmbeddings) ou, opcionalmente,
+# "onnx" (ONNX Runtime int8). Os vetores dos dois backends não são idênticos:
+# vectorstores criados com um backend não são usados com o outro.
+BACKEND_EMBEDDINGS = os.getenv("EMBEDDINGS_BACKEND", "torch").lower()
+if BACKEND_EMBEDDINGS == "onnx" and not ONNX_DISPONIVEL:
+    logger.warning("EMBEDDINGS_BACKEND=onnx, mas optimum não está instalado; usando torch")
+    BACKEND_EMBEDDINGS = "torch"
+DIRETORIO_MODELO_ONNX = "./onnx_models/paraphrase-multilingual-MiniLM-L12-v2"
+ARQUIVO_MODELO_ONNX = "model_optimized_quantized.onnx"
+TAMANHO_LOTE_ONNX = 32
+MAX_TOKENS_EMBEDDING = 128
+
+# Threads do PyTorch para o backend "torch" (containers com cota de CPU
+# devem definir EMBED_TORCH_THREADS)
+THREADS_TORCH_EMBEDDINGS = int(os.getenv("EMBED_TORCH_THREADS", os.cpu_count() or 4))
+
+# Identifica modelo + backend nas chaves do cache de embeddings
+IDENTIFICADOR_EMBEDDINGS = (
+    f"{MODELO_EMBEDDINGS}:onnx-int8" if BACKEND_EMBEDDINGS == "onnx" else MODELO_EMBEDDINGS
+)
+
+TAMANHO_LOTE_EMBEDDINGS = 1024
+TAMANHO_LOTE_CACHE = 500  # chaves por consulta ao cache (limite de parâmetros do SQLite)
+
 # Cache do modelo de embeddings 
 _modelo_embeddings = None
+_trava_embeddings = threading.Lock()
+
+# Arquivo, dentro de cada vectorstore, com o IDENTIFICADOR_EMBEDDINGS usado
+ARQUIVO_IDENTIFICADOR_EMBEDDINGS = "embeddings.txt"
+
+# Clientes do LLM reaproveitados entre perguntas (pool HTTP do Groq)
+_cache_llm: Dict[tuple, "ChatGroq"] = {}
+
+# Cache de vectorstores: id_sessao -> (mtime do índice, vectorstore)
+_cache_vectorstores: "OrderedDict[int, tuple]" = OrderedDict()
+_trava_cache_vectorstores = threading.Lock()
+
+
+def _exportar_modelo_onnx(destino: str):
+    """
+    Exporta o modelo de embeddings para ONNX uma única vez, aplica as
+    otimizações de grafo (O2) e quantização dinâmica int8.
+    """
+    logger.info("Exportando modelo de embeddings para ONNX...")
+    # Exporta em diretório temporário e renomeia: outro worker exportando ao
+    # mesmo tempo nunca vê (nem usa) um diretório pela metade
+    temporario = f"{destino}.tmp-{uuid.uuid4().hex}"
+    modelo = ORTModelForFeatureExtraction.from_pretrained(MODELO_EMBEDDINGS, export=True)
+    otimizador = ORTOptimizer.from_pretrained(modelo)
+    otimizador.optimize(
+        save_dir=temporario,
+        optimization_config=OptimizationConfig(optimization_level=2),
+    )
+    quantizador = ORTQuantizer.from_pretrained(temporario, file_name="model_optimized.onnx")
+    quantizador.quantize(
+        save_dir=temporario,
+        quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False),
+    )
+    AutoTokenizer.from_pretrained(MODELO_EMBEDDINGS).save_pretrained(temporario)
+    try:
+        os.makedirs(os.path.dirname(destino) or ".", exist_ok=True)
+        os.rename(temporario, destino)
+    except OSError:
+        # Outro processo terminou a exportação primeiro
+        shutil.rmtree(temporario, ignore_errors=True)
+    logger.info(f"Modelo ONNX salvo em {destino}")
+
+
+class EmbeddingsONNX(Embeddings):
+    """
+    Embeddings do MiniLM via ONNX Runtime (grafo otimizado + int8).
+
+    Reproduz o SentenceTransformer original: mean pooling sobre a máscara
+    de atenção seguido de normalização L2.
+    """
+
+    def __init__(self, diretorio: str = DIRETORIO_MODELO_ONNX):
+        if not os.path.exists(os.path.join(diretorio, ARQUIVO_MODELO_ONNX)):
+            _exportar_modelo_onnx(diretorio)
+        self.tokenizer = AutoTokenizer.from_pretrained(diretorio)
+        self.modelo = ORTModelForFeatureExtraction.from_pretrained(
+            diretorio, file_name=ARQUIVO_MODELO_ONNX
+        )
+
+    def encode(self, textos: List[str], batch_size: int = TAMANHO_LOTE_ONNX) -> "np.ndarray":
+        # Lotes de textos com tamanho parecido reduzem o padding
+        ordem = sorted(range(len(textos)), key=lambda i: len(textos[i]), reverse=True)
+        vetores = [None] * len(textos)
+        for inicio in range(0, len(ordem), batch_size):
+            indices = ordem[inicio:inicio + batch_size]
+            tokens = self.tokenizer(
+                [textos[i] for i in indices],
+                padding=True,
+                truncation=True,
+                max_length=MAX_TOKENS_EMBEDDING,
+                return_tensors="np",
+            )
+            estados = self.modelo(**tokens).last_hidden_state
+            mascara = tokens["attention_mask"][..., None].astype(np.float32)
+            media = (estados * mascara).sum(axis=1) / np.clip(mascara.sum(axis=1), 1e-9, None)
+            media /= np.clip(np.linalg.norm(media, axis=1, keepdims=True), 1e-12, None)
+            for i, vetor in zip(indices, media):
+                vetores[i] = vetor
+        return np.stack(vetores).astype("float32", copy=False)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.encode([text])[0].tolist()
+
+
+def obter_llm() -> "ChatGroq":
+    """Retorna o cliente ChatGroq da configuração atual, criado uma única vez"""
+    chave = (MODELO_LLM, TEMPERATURA_LLM, MAX_TOKENS_RESPOSTA)
+    llm = _cache_llm.get(chave)
+    if llm is None:
+        llm = _cache_llm[chave] = ChatGroq(
+            temperature=TEMPERATURA_LLM,
+            model_name=MODELO_LLM,
+            groq_api_key=CHAVE_API_GROQ,
+            max_tokens=MAX_TOKENS_RESPOSTA
+        )
+    return llm
+
+
+def _configurar_threads_torch():
+    import torch
+
+    torch.set_num_threads(THREADS_TORCH_EMBEDDINGS)
+    try:
+        torch.set_num_interop_threads(2)
+    except RuntimeError:
+        # Só pode ser definido antes do primeiro trabalho paralelo do processo
+        pass
 
 
 def obter_embeddings():
@@ -74,24 +266,153 @@ def obter_embeddings():
     subsequentes para economizar memória e tempo de inicialização.
 
     Returns:
-        HuggingFaceEmbeddings: Modelo de embeddings multilíngue
+        EmbeddingsONNX ou HuggingFaceEmbeddings, conforme BACKEND_EMBEDDINGS
 
     Note:
         Usa o modelo 'paraphrase-multilingual-MiniLM-L12-v2' otimizado
         para português e outros idiomas.
     """
     global _modelo_embeddings
-    if _modelo_embeddings is None:
-        logger.info("Carregando modelo de embeddings...")
-        _modelo_embeddings = HuggingFaceEmbeddings(
-            model_name=MODELO_EMBEDDINGS,
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        logger.info("Modelo de embeddings carregado!")
+    if _modelo_embeddings is not None:
+        return _modelo_embeddings
+    # Chamado de várias threads (to_thread): só uma carrega/exporta o modelo
+    with _trava_embeddings:
+        if _modelo_embeddings is None:
+            logger.info(f"Carregando modelo de embeddings (backend: {BACKEND_EMBEDDINGS})...")
+            if BACKEND_EMBEDDINGS == "onnx":
+                _modelo_embeddings = EmbeddingsONNX()
+            else:
+                _configurar_threads_torch()
+                _modelo_embeddings = HuggingFaceEmbeddings(
+                    model_name=MODELO_EMBEDDINGS,
+                    model_kwargs={'device': 'cpu'},
+                    encode_kwargs={'normalize_embeddings': True}
+                )
+            logger.info("Modelo de embeddings carregado!")
     return _modelo_embeddings
 
 
+def codificar_textos(textos: List[str]) -> "np.ndarray":
+    """
+    Gera os embeddings de vários textos em uma única chamada ao backend.
+    No PyTorch, o SentenceTransformer já ordena as entradas por tamanho para
+    reduzir padding; lotes grandes amortizam o overhead por lote na CPU.
+    """
+    embeddings = obter_embeddings()
+    if isinstance(embeddings, EmbeddingsONNX):
+        return embeddings.encode(textos)
+    return embeddings.client.encode(
+        textos,
+        batch_size=TAMANHO_LOTE_EMBEDDINGS,
+        show_progress_bar=False,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    ).astype("float32", copy=False)
+
+
+def _chave_embedding(texto: str) -> bytes:
+    return hashlib.sha256(f"{IDENTIFICADOR_EMBEDDINGS}\0{texto}".encode("utf-8")).digest()
+
+
+def codificar_textos_com_cache(textos: List[str]) -> "np.ndarray":
+    """
+    Igual a `codificar_textos`, mas reaproveita embeddings já calculados.
+
+    Os vetores ficam na tabela embedding_cache, chaveados por
+    sha256(modelo + texto); só os textos ausentes passam pelo modelo.
+    Reenviar um material pouco alterado recalcula apenas os chunks novos.
+    """
+    chaves = [_chave_embedding(texto) for texto in textos]
+    vetores: Dict[bytes, "np.ndarray"] = {}
+
+    db = SessionLocal()
+    try:
+        for inicio in range(0, len(chaves), TAMANHO_LOTE_CACHE):
+            lote = chaves[inicio:inicio + TAMANHO_LOTE_CACHE]
+            for linha in db.query(EmbeddingCache).filter(EmbeddingCache.key.in_(lote)):
+                vetores[linha.key] = np.frombuffer(linha.vec, dtype=np.float16)
+
+        faltantes = {}
+        for chave, texto in zip(chaves, textos):
+            if chave not in vetores:
+                faltantes[chave] = texto
+
+        if faltantes:
+            logger.info(f"Embeddings: {len(vetores)} em cache, {len(faltantes)} novos")
+            novos = codificar_textos(list(faltantes.values())).astype(np.float16)
+            for chave, vetor in zip(faltantes, novos):
+                vetores[chave] = vetor
+            try:
+                db.add_all(
+                    EmbeddingCache(key=chave, vec=vetores[chave].tobytes())
+                    for chave in faltantes
+                )
+                db.commit()
+            except IntegrityError:
+                # Outra requisição gravou as mesmas chaves primeiro
+                db.rollback()
+    finally:
+        db.close()
+
+    return np.stack([vetores[chave] for chave in chaves]).astype("float32")
+
+
+def criar_indice_faiss(vetores: "np.ndarray"):
+    """
+    Cria o índice FAISS para os vetores dos chunks.
+
+    Os embeddings são normalizados, então toleram bem quantização escalar:
+    - até MIN_CHUNKS_IVF: busca exata com vetores em float16 (SQfp16)
+    - até MIN_CHUNKS_PQ: IVF + int8 por dimensão (SQ8), 4x menos memória
+    - acima disso: IVF + Product Quantization (PQ32x8), ~48x menos memória
+    Nos índices IVF cada consulta visita só `nprobe` listas.
+    """
+    num_vetores, dimensao = vetores.shape
+    if num_vetores < MIN_CHUNKS_IVF:
+        indice = faiss.index_factory(dimensao, "SQfp16")
+    else:
+        nlist = max(1, min(int(4 * math.sqrt(num_vetores)), num_vetores // 40))
+        if num_vetores >= MIN_CHUNKS_PQ and dimensao % 32 == 0:
+            quantizacao = "PQ32x8"
+        else:
+            quantizacao = "SQ8"
+        indice = faiss.index_factory(dimensao, f"IVF{nlist},{quantizacao}")
+        faiss.extract_index_ivf(indice).nprobe = NPROBE_FAISS
+    if not indice.is_trained:
+        indice.train(vetores)
+    indice.add(vetores)
+    return indice
+
+
+def _hash_arquivo(caminho_arquivo: str) -> str:
+    h = hashlib.sha256()
+    with open(caminho_arquivo, "rb") as arquivo:
+        for bloco in iter(lambda: arquivo.read(1 << 20), b""):
+            h.update(bloco)
+    return h.hexdigest()
+
+
+def _ler_extracao_em_cache(caminho_cache: str) -> Optional[List[Document]]:
+    try:
+        with open(caminho_cache, encoding="utf-8") as arquivo:
+            paginas = json.load(arquivo)
+    except (OSError, ValueError):
+        return None
+    return [Document(page_content=texto, metadata=metadados) for texto, metadados in paginas]
+
+
+def _gravar_extracao_em_cache(caminho_cache: str, documentos: List[Document]):
+    temporario = f"{caminho_cache}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temporario, "w", encoding="utf-8") as arquivo:
+            json.dump([(doc.page_content, doc.metadata) for doc in documentos], arquivo, ensure_ascii=False)
+        os.replace(temporario, caminho_cache)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"Não foi possível gravar cache de extração: {e}")
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
 def carregar_documento_arquivo(caminho_arquivo: str, nome_arquivo: str) -> List[Document]:
     """
     Carrega documento usando UnstructuredFileLoader (detecção automática de tipo).
@@ -109,10 +430,24 @@ def carregar_documento_arquivo(caminho_arquivo: str, nome_arquivo: str) -> List[
     Note:
         Tipos suportados: PDF, DOCX, XLSX, PPTX, TXT, MD, HTML, XML,
         CSV, RTF, ODT, e muitos outros formatos.
+
+        O texto extraído é guardado em DIRETORIO_CACHE_EXTRACAO pelo hash do
+        conteúdo; o mesmo arquivo enviado de novo não passa pelo parser.
     """
     try:
         extensao = nome_arquivo.lower().split('.')[-1]
 
+        caminho_cache = os.path.join(
+            DIRETORIO_CACHE_EXTRACAO, f"{_hash_arquivo(caminho_arquivo)}.{extensao}.json"
+        )
+        documentos = _ler_extracao_em_cache(caminho_cache)
+        if documentos is not None:
+            for doc in documentos:
+                doc.metadata["filename"] = nome_arquivo
+                doc.metadata["source"] = nome_arquivo
+            logger.info(f"{nome_arquivo}: {len(documentos)} documento(s) do cache de extração")
+            return documentos
+
         # Usa carregadores específicos (mais estáveis que UnstructuredFileLoader)
         if extensao == 'pdf':
             from langchain_community.document_loaders import PyPDFLoader
@@ -128,6 +463,7 @@ def carregar_documento_arquivo(caminho_arquivo: str, nome_arquivo: str) -> List[
             raise ValueError(f"Tipo de arquivo não suportado: {extensao}. Use PDF, DOCX ou TXT")
 
         documentos = carregador.load()
+        _gravar_extracao_em_cache(caminho_cache, documentos)
 
         # Adiciona metadados
         for doc in documentos:
@@ -175,16 +511,24 @@ def criar_vectorstore(
         )
         todos_documentos.append(doc)
 
-    # Processa arquivos com UnstructuredFileLoader
+    # Processa os arquivos em threads. Só sobrepõe o que libera o GIL: leitura
+    # de disco, descompressão zlib dos DOCX e o sha256 do cache de extração.
+    # O parsing do pypdf é Python puro e continua serializado pelo GIL.
     if arquivos:
-        for caminho_arquivo, nome_arquivo in arquivos:
-            try:
+        with ThreadPoolExecutor(max_workers=min(MAX_THREADS_ARQUIVOS, len(arquivos))) as executor:
+            futuros = []
+            for caminho_arquivo, nome_arquivo in arquivos:
                 logger.info(f"Processando {nome_arquivo}...")
-                documentos = carregar_documento_arquivo(caminho_arquivo, nome_arquivo)
-                todos_documentos.extend(documentos)
-            except Exception as e:
-                logger.error(f"Erro ao processar {nome_arquivo}: {e}")
-                continue
+                futuros.append(
+                    executor.submit(carregar_documento_arquivo, caminho_arquivo, nome_arquivo)
+                )
+
+            # Mantém a ordem original dos arquivos
+            for (_, nome_arquivo), futuro in zip(arquivos, futuros):
+                try:
+                    todos_documentos.extend(futuro.result())
+                except Exception as e:
+                    logger.error(f"Erro ao processar {nome_arquivo}: {e}")
 
     if not todos_documentos:
         raise ValueError("Nenhum documento foi processado")
@@ -203,39 +547,121 @@ def criar_vectorstore(
 
     # Cria vectorstore FAISS
     embeddings = obter_embeddings()
-    vectorstore = FAISS.from_documents(pedacos, embeddings)
+    vetores = codificar_textos_com_cache([p.page_content for p in pedacos])
+    ids = [str(uuid.uuid4()) for _ in pedacos]
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=criar_indice_faiss(vetores),
+        docstore=InMemoryDocstore(dict(zip(ids, pedacos))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
 
-    # Salva no disco
+    # Salva no disco. Grava num diretório temporário exclusivo (uploads
+    # simultâneos da mesma sessão não se misturam) e troca arquivo a arquivo
+    # com os.replace: quem ainda tem o índice antigo mapeado (mmap) não é
+    # afetado. A troca NÃO é atômica como um todo: entre um os.replace e
+    # outro, um leitor pode ver o index.pkl novo com o index.faiss antigo.
+    # O index.faiss vai por último e o cache de carregar_vectorstore é
+    # indexado pelo mtime dele, então uma cópia misturada é relida assim
+    # que a troca termina.
     caminho_vectorstore = os.path.join(DIRETORIO_VECTORSTORE, f"session_{id_sessao}")
-    vectorstore.save_local(caminho_vectorstore)
+    os.makedirs(caminho_vectorstore, exist_ok=True)
+    caminho_temporario = f"{caminho_vectorstore}.{uuid.uuid4().hex}.tmp"
+    try:
+        vectorstore.save_local(caminho_temporario)
+        with open(os.path.join(caminho_temporario, ARQUIVO_IDENTIFICADOR_EMBEDDINGS), "w") as arquivo:
+            arquivo.write(IDENTIFICADOR_EMBEDDINGS)
+        for nome in (ARQUIVO_IDENTIFICADOR_EMBEDDINGS, "index.pkl", "index.faiss"):
+            os.replace(
+                os.path.join(caminho_temporario, nome),
+                os.path.join(caminho_vectorstore, nome),
+            )
+    finally:
+        shutil.rmtree(caminho_temporario, ignore_errors=True)
+    invalidar_vectorstore(id_sessao)
     logger.info(f"Vectorstore salvo em {caminho_vectorstore}")
 
     return vectorstore
 
 
 def carregar_vectorstore(id_sessao: int) -> Optional[FAISS]:
-    """Carrega vectorstore do disco"""
+    """
+    Carrega vectorstore do disco, reaproveitando a cópia em memória.
+
+    Mantém até MAX_VECTORSTORES_EM_CACHE sessões (LRU); a entrada é
+    descartada se o arquivo do índice mudar no disco. O índice é aberto com
+    mmap somente leitura, então as listas invertidas ficam no page cache do
+    sistema e são compartilhadas entre workers.
+    """
     if not LANGCHAIN_DISPONIVEL:
         return None
 
     caminho_vectorstore = os.path.join(DIRETORIO_VECTORSTORE, f"session_{id_sessao}")
 
-    if not os.path.exists(caminho_vectorstore):
+    caminho_indice = os.path.join(caminho_vectorstore, "index.faiss")
+    try:
+        mtime = os.path.getmtime(caminho_indice)
+    except OSError:
+        return None
+
+    with _trava_cache_vectorstores:
+        em_cache = _cache_vectorstores.get(id_sessao)
+        if em_cache and em_cache[0] == mtime:
+            _cache_vectorstores.move_to_end(id_sessao)
+            return em_cache[1]
+
+    identificador = _identificador_vectorstore(caminho_vectorstore)
+    if identificador != IDENTIFICADOR_EMBEDDINGS:
+        logger.warning(
+            f"Vectorstore da sessão {id_sessao} foi criado com '{identificador}', "
+            f"mas o backend atual é '{IDENTIFICADOR_EMBEDDINGS}'; reenvie os materiais"
+        )
         return None
 
     try:
         embeddings = obter_embeddings()
-        vectorstore = FAISS.load_local(
-            caminho_vectorstore,
-            embeddings,
-            allow_dangerous_deserialization=True  # Necessário para FAISS
+        indice = faiss.read_index(
+            caminho_indice, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        )
+        if isinstance(indice, faiss.IndexIVF):
+            indice.nprobe = NPROBE_FAISS
+        # Mesmo formato gravado por FAISS.save_local (arquivo gerado por nós)
+        with open(os.path.join(caminho_vectorstore, "index.pkl"), "rb") as arquivo:
+            docstore, index_to_docstore_id = pickle.load(arquivo)
+        vectorstore = FAISS(
+            embedding_function=embeddings,
+            index=indice,
+            docstore=docstore,
+            index_to_docstore_id=index_to_docstore_id,
         )
         logger.info(f"Vectorstore carregado de {caminho_vectorstore}")
-        return vectorstore
     except Exception as e:
         logger.error(f"Erro ao carregar vectorstore: {e}")
         return None
 
+    with _trava_cache_vectorstores:
+        _cache_vectorstores[id_sessao] = (mtime, vectorstore)
+        _cache_vectorstores.move_to_end(id_sessao)
+        while len(_cache_vectorstores) > MAX_VECTORSTORES_EM_CACHE:
+            _cache_vectorstores.popitem(last=False)
+    return vectorstore
+
+
+def _identificador_vectorstore(caminho_vectorstore: str) -> str:
+    """Modelo/backend de embeddings com que o vectorstore foi criado"""
+    try:
+        with open(os.path.join(caminho_vectorstore, ARQUIVO_IDENTIFICADOR_EMBEDDINGS)) as arquivo:
+            return arquivo.read().strip()
+    except OSError:
+        # Vectorstores antigos (sem o arquivo) foram criados com o backend torch
+        return MODELO_EMBEDDINGS
+
+
+def invalidar_vectorstore(id_sessao: int):
+    """Remove o vectorstore da sessão do cache em memória"""
+    with _trava_cache_vectorstores:
+        _cache_vectorstores.pop(id_sessao, None)
+
 
 def salvar_contexto_ia_langchain(
     db: Session,
@@ -268,9 +694,7 @@ def salvar_contexto_ia_langchain(
     resumo = " | ".join(partes_resumo) if partes_resumo else "Materiais processados"
 
     # Salva/atualiza no banco
-    contexto_existente = db.query(AIContext).filter(
-        AIContext.session_id == id_sessao
-    ).first()
+    contexto_existente = obter_contexto_ia(db, id_sessao)
 
     if contexto_existente:
         contexto_existente.context_text = resumo
@@ -291,9 +715,10 @@ def salvar_contexto_ia_langchain(
 
 def obter_contexto_ia(db: Session, id_sessao: int) -> Optional[AIContext]:
     """Busca contexto de IA"""
-    return db.query(AIContext).filter(
-        AIContext.session_id == id_sessao
-    ).first()
+    stmt = lambda_stmt(
+        lambda: select(AIContext).where(AIContext.session_id == id_sessao)
+    )
+    return db.execute(stmt).scalars().first()
 
 
 def salvar_mensagem_conversa(
@@ -315,6 +740,21 @@ def salvar_mensagem_conversa(
     return conversa
 
 
+def salvar_par_conversa(
+    db: Session,
+    id_sessao: int,
+    id_usuario: int,
+    pergunta: str,
+    resposta: str
+) -> None:
+    """Salva pergunta e resposta em uma única transação"""
+    db.add_all([
+        AIConversation(session_id=id_sessao, user_id=id_usuario, role="user", message=pergunta),
+        AIConversation(session_id=id_sessao, user_id=id_usuario, role="assistant", message=resposta),
+    ])
+    db.commit()
+
+
 def obter_historico_conversa(
     db: Session,
     id_sessao: int,
@@ -322,10 +762,36 @@ def obter_historico_conversa(
     limite: int = 50
 ) -> List[AIConversation]:
     """Busca histórico de conversas"""
-    return db.query(AIConversation).filter(
-        AIConversation.session_id == id_sessao,
-        AIConversation.user_id == id_usuario
-    ).order_by(AIConversation.timestamp.desc()).limit(limite).all()
+    stmt = lambda_stmt(
+        lambda: select(AIConversation)
+        .where(
+            AIConversation.session_id == id_sessao,
+            AIConversation.user_id == id_usuario
+        )
+        .order_by(AIConversation.timestamp.desc())
+        .limit(limite)
+    )
+    return db.execute(stmt).scalars().all()
+
+
+def montar_historico_chat(historico: List[AIConversation]) -> List[tuple]:
+    """
+    Converte o histórico (mais recente primeiro) em pares (pergunta, resposta)
+    em ordem cronológica, numa única passada e sem recriar tuplas.
+    """
+    historico_chat = []
+    pergunta = None
+    resposta = ""
+    for conv in reversed(historico):
+        if conv.role == "user":
+            if pergunta is not None:
+                historico_chat.append((pergunta, resposta))
+            pergunta, resposta = conv.message, ""
+        elif conv.role == "assistant" and pergunta is not None:
+            resposta = conv.message
+    if pergunta is not None:
+        historico_chat.append((pergunta, resposta))
+    return historico_chat
 
 
 def perguntar_assistente_ia_langchain(
@@ -369,23 +835,11 @@ def perguntar_assistente_ia_langchain(
         }
 
     try:
-        # Inicializa LLM Groq
-        llm = ChatGroq(
-            temperature=TEMPERATURA_LLM,
-            model_name=MODELO_LLM,
-            groq_api_key=CHAVE_API_GROQ,
-            max_tokens=MAX_TOKENS_RESPOSTA
-        )
+        llm = obter_llm()
 
         # Busca histórico de conversas
         historico = obter_historico_conversa(db, id_sessao, id_usuario, limite=LIMITE_HISTORICO_CHAT)
-        historico_chat = []
-        for conv in reversed(historico):
-            if conv.role == "user":
-                historico_chat.append((conv.message, ""))
-            elif historico_chat and conv.role == "assistant":
-                # Completa o último par
-                historico_chat[-1] = (historico_chat[-1][0], conv.message)
+        historico_chat = montar_historico_chat(historico)
 
         # Cria chain conversacional
         cadeia_qa = ConversationalRetrievalChain.from_llm(
@@ -414,8 +868,7 @@ def perguntar_assistente_ia_langchain(
                     fontes_vistas.add(fonte)
 
         # Salva conversa
-        salvar_mensagem_conversa(db, id_sessao, id_usuario, "user", pergunta)
-        salvar_mensagem_conversa(db, id_sessao, id_usuario, "assistant", resposta)
+        salvar_par_conversa(db, id_sessao, id_usuario, pergunta, resposta)
 
         return {
             "success": True,
@@ -435,6 +888,57 @@ def perguntar_assistente_ia_langchain(
         }
 
 
+def buscar_documentos_relevantes(id_sessao: int, pergunta: str) -> Optional[List[Document]]:
+    """Busca os chunks mais relevantes; None se o vectorstore não carregar"""
+    vectorstore = carregar_vectorstore(id_sessao)
+    if not vectorstore:
+        return None
+    return vectorstore.similarity_search(pergunta, k=NUM_DOCUMENTOS_RELEVANTES)
+
+
+def transmitir_resposta_ia(
+    id_sessao: int,
+    id_usuario: int,
+    pergunta: str,
+    documentos: List[Document],
+    historico_chat: List[tuple]
+) -> Iterator[str]:
+    """
+    Gera a resposta do LLM em pedaços, à medida que o Groq os envia.
+
+    A conversa é salva ao final do stream, com uma sessão de banco própria,
+    já que a sessão da requisição pode ter sido fechada. Erros antes do
+    primeiro pedaço são propagados; depois dele, o stream termina com
+    MARCADOR_ERRO_STREAMING e a conversa não é salva.
+    """
+    contexto = "\n\n".join(doc.page_content for doc in documentos)
+    mensagens = [SystemMessage(content=PROMPT_SISTEMA_STREAMING.format(contexto=contexto))]
+    for pergunta_anterior, resposta_anterior in historico_chat:
+        mensagens.append(HumanMessage(content=pergunta_anterior))
+        if resposta_anterior:
+            mensagens.append(AIMessage(content=resposta_anterior))
+    mensagens.append(HumanMessage(content=pergunta))
+
+    partes = []
+    try:
+        for pedaco in obter_llm().stream(mensagens):
+            if pedaco.content:
+                partes.append(pedaco.content)
+                yield pedaco.content
+    except Exception as e:
+        logger.error(f"Erro no streaming do LLM: {e}")
+        if not partes:
+            raise
+        yield MARCADOR_ERRO_STREAMING
+        return
+
+    db = SessionLocal()
+    try:
+        salvar_par_conversa(db, id_sessao, id_usuario, pergunta, "".join(partes))
+    finally:
+        db.close()
+
+
 def limpar_historico_conversa(db: Session, id_sessao: int, id_usuario: int) -> bool:
     """Limpa histórico de conversas"""
     try:
@@ -3,14 +3,17 @@ Authentication module with JWT tokens
 """
 import logging
 import os
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import lambda_stmt, select
 from sqlalchemy.orm import Session
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr
 
 from database import get_db, User
 
@@ -27,10 +30,25 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# argon2id (parâmetros mínimos da OWASP); hashes bcrypt antigos continuam
+# válidos e são convertidos no próximo login
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    deprecated="auto",
+    argon2__memory_cost=19456,
+    argon2__time_cost=2,
+    argon2__parallelism=1,
+)
 
 security = HTTPBearer()
 
+# Cache de tokens já validados: evita refazer o HMAC a cada requisição de
+# polling. Entradas expiram em TOKEN_CACHE_TTL segundos ou no "exp" do token.
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE_MAX_SIZE = 4096
+_token_cache: Dict[str, Tuple["TokenData", float]] = {}
+_token_cache_lock = threading.Lock()
+
 
 
 class UserCreate(BaseModel):
@@ -46,6 +64,8 @@ class UserLogin(BaseModel):
 
 
 class UserResponse(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     email: str
     username: str
@@ -53,9 +73,6 @@ class UserResponse(BaseModel):
     is_active: bool
     created_at: datetime
 
-    class Config:
-        from_attributes = True
-
 
 class Token(BaseModel):
     access_token: str
@@ -92,6 +109,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
 
 def decode_token(token: str) -> TokenData:
     """Decodificar e validar um token JWT"""
+    now = time.time()
+    cached = _token_cache.get(token)
+    if cached and cached[1] > now:
+        return cached[0]
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id_str: str = payload.get("sub")
@@ -103,7 +125,7 @@ def decode_token(token: str) -> TokenData:
             )
         # Convert string back to int
         user_id: int = int(user_id_str)
-        return TokenData(user_id=user_id, email=email)
+        token_data = TokenData(user_id=user_id, email=email)
     except JWTError as e:
         logger.warning("Erro ao decodificar token JWT: %s (tipo: %s)", str(e), type(e).__name__)
         raise HTTPException(
@@ -111,8 +133,15 @@ def decode_token(token: str) -> TokenData:
             detail="Token inválido ou expirado"
         )
 
+    expires_at = min(now + TOKEN_CACHE_TTL, payload.get("exp", now))
+    with _token_cache_lock:
+        if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+            _token_cache.pop(next(iter(_token_cache)))
+        _token_cache[token] = (token_data, expires_at)
+    return token_data
 
-async def get_current_user(
+
+def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db)
 ) -> User:
@@ -123,7 +152,7 @@ async def get_current_user(
         token_data = decode_token(token)
         logger.debug("Token decodificado - user_id: %s, email: %s", token_data.user_id, token_data.email)
 
-        user = db.query(User).filter(User.id == token_data.user_id).first()
+        user = db.get(User, token_data.user_id)
         if user is None:
             logger.warning("Tentativa de autenticação com user_id inexistente: %s", token_data.user_id)
             raise HTTPException(
@@ -148,7 +177,7 @@ async def get_current_user(
         )
 
 
-async def get_current_teacher(current_user: User = Depends(get_current_user)) -> User:
+def get_current_teacher(current_user: User = Depends(get_current_user)) -> User:
     """Garantir que o usuário atual seja um professor"""
     if current_user.role not in ["teacher", "admin"]:
         raise HTTPException(
@@ -158,7 +187,7 @@ async def get_current_teacher(current_user: User = Depends(get_current_user)) ->
     return current_user
 
 
-async def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
+def get_current_admin(current_user: User = Depends(get_current_user)) -> User:
     """Garantir que o usuário atual seja um administrador"""
     if current_user.role != "admin":
         raise HTTPException(
@@ -168,20 +197,30 @@ async def get_current_admin(current_user: User = Depends(get_current_user)) -> U
     return current_user
 
 
+def _buscar_usuario_por_email(db: Session, email: str) -> Optional[User]:
+    # lambda_stmt guarda o SQL compilado; só o parâmetro muda entre chamadas
+    stmt = lambda_stmt(lambda: select(User).where(User.email == email))
+    return db.execute(stmt).scalars().first()
+
+
 def authenticate_user(db: Session, email: str, password: str) -> Optional[User]:
     """Autenticar um usuário por email e senha"""
-    user = db.query(User).filter(User.email == email).first()
+    user = _buscar_usuario_por_email(db, email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = pwd_context.verify_and_update(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        user.hashed_password = new_hash
+        db.commit()
     return user
 
 
 def create_user(db: Session, user_data: UserCreate) -> User:
     """Criar um novo usuário"""
     # Verificar se o usuário já existe
-    existing_user = db.query(User).filter(User.email == user_data.email).first()
+    existing_user = _buscar_usuario_por_email(db, user_data.email)
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -1,7 +1,6 @@
 import json
 import logging
 import os
-from functools import lru_cache
 from pathlib import Path
 from typing import Any, Dict, List
 
@@ -10,10 +9,9 @@ logger = logging.getLogger("attention-api.config")
 CONFIG_PATH = Path(__file__).resolve().parents[1] / "config.json"
 
 
-@lru_cache()
-def get_model_config() -> Dict[str, Any]:
+def _load_model_config() -> Dict[str, Any]:
     """
-    Carrega configurações do modelo (apenas uma vez).
+    Carrega configurações do modelo.
     Valida que o arquivo existe e contém dados válidos.
     """
     if not CONFIG_PATH.exists():
@@ -36,7 +34,15 @@ def get_model_config() -> Dict[str, Any]:
         raise ValueError(f"Erro ao decodificar config.json: {e}")
 
 
-def get_allowed_origins() -> List[str]:
+MODEL_CONFIG = _load_model_config()
+
+
+def get_model_config() -> Dict[str, Any]:
+    """Retorna as configurações do modelo, carregadas na importação."""
+    return MODEL_CONFIG
+
+
+def _load_allowed_origins() -> List[str]:
     """
     Lê origens permitidas da variável de ambiente ALLOWED_ORIGINS.
     Retorna lista de origens validadas (URLs bem formatadas).
@@ -70,9 +76,9 @@ def get_allowed_origins() -> List[str]:
     return validated_origins
 
 
-def get_environment() -> str:
+def _load_environment() -> str:
     """
-    Retorna o ambiente de execução: development, staging ou production.
+    Lê o ambiente de execução: development, staging ou production.
     """
     env = os.getenv("ENVIRONMENT", "development").lower()
     valid_environments = ["development", "staging", "production"]
@@ -89,7 +95,23 @@ def get_environment() -> str:
     return env
 
 
+# Variáveis de ambiente não mudam em execução: lidas uma única vez
+ALLOWED_ORIGINS = _load_allowed_origins()
+ENVIRONMENT = _load_environment()
+IS_PRODUCTION = ENVIRONMENT == "production"
+
+
+def get_allowed_origins() -> List[str]:
+    """Retorna as origens CORS permitidas."""
+    return ALLOWED_ORIGINS
+
+
+def get_environment() -> str:
+    """Retorna o ambiente de execução: development, staging ou production."""
+    return ENVIRONMENT
+
+
 def is_production() -> bool:
     """Retorna True se estiver em ambiente de produção."""
-    return get_environment() == "production"
+    return IS_PRODUCTION
 
@@ -4,14 +4,44 @@ Stores users, sessions, and attention metrics
 """
 import os
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Text
+from sqlalchemy import create_engine, event, Column, Integer, String, Float, DateTime, Boolean, ForeignKey, Index, LargeBinary, Text, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./attention_app.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+
+# check_same_thread só existe no driver sqlite3
+connect_args = {"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {}
+
+engine = create_engine(
+    DATABASE_URL,
+    connect_args=connect_args,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=1800,
+    pool_use_lifo=True,  # conexões ociosas sobram no fim da fila e expiram
+)
+
+
+if engine.dialect.name == "sqlite":
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        """WAL permite leituras concorrentes durante escritas"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-65536")  # 64 MB
+        cursor.execute("PRAGMA mmap_size=268435456")  # 256 MB
+        cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -67,6 +97,16 @@ class SessionParticipant(Base):
     session = relationship("ClassSession", back_populates="participants")
     user = relationship("User", back_populates="session_participations")
 
+    __table_args__ = (
+        # Índice parcial: só participações em aberto (sessões ativas do aluno)
+        Index(
+            "ix_session_participant_active_user",
+            "user_id",
+            sqlite_where=text("left_at IS NULL"),
+            postgresql_where=text("left_at IS NULL"),
+        ),
+    )
+
 
 class AttentionMetric(Base):
     """Armazena métricas de atenção para análise"""
@@ -85,6 +125,13 @@ class AttentionMetric(Base):
     user = relationship("User", back_populates="attention_metrics")
     session = relationship("ClassSession", back_populates="attention_metrics")
 
+    __table_args__ = (
+        # Histórico do dashboard: session_id = ? AND timestamp >= ?
+        Index("ix_attention_metric_session_ts", "session_id", "timestamp"),
+        # Estatísticas por usuário servidas direto do índice
+        Index("ix_attention_metric_user_stats", "user_id", "is_attentive", "confidence"),
+    )
+
 
 class ChatMessage(Base):
     """Armazena mensagens de chat para sessões"""
@@ -96,6 +143,10 @@ class ChatMessage(Base):
     message = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_chat_message_session_ts", "session_id", "timestamp"),
+    )
+
 
 class Transcript(Base):
     """Armazena transcrições para sessões"""
@@ -107,6 +158,10 @@ class Transcript(Base):
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        Index("ix_transcript_session_ts", "session_id", "timestamp"),
+    )
+
 
 class AIContext(Base):
     """Armazena contexto/materiais de IA para cada sessão"""
@@ -130,10 +185,27 @@ class AIConversation(Base):
     message = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # Histórico por aluno: session_id = ? AND user_id = ? ORDER BY timestamp DESC
+        Index("ix_ai_conversation_session_user_ts", "session_id", "user_id", "timestamp"),
+    )
+
+
+class EmbeddingCache(Base):
+    """Cache de embeddings por (modelo, sha256 do texto), em float16"""
+    __tablename__ = "embedding_cache"
+
+    key = Column(LargeBinary(32), primary_key=True)
+    vec = Column(LargeBinary, nullable=False)
+
 
 def init_db():
-    """Criar todas as tabelas"""
+    """Criar todas as tabelas e índices ausentes"""
     Base.metadata.create_all(bind=engine)
+    # create_all não adiciona índices novos a tabelas que já existem
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
 
 
 def get_db():
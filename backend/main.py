@@ -1,7 +1,10 @@
 """
 Backend API para o sistema de sala de aula com atenção e IA.
 """
+import asyncio
 import logging
+import os
+import sys
 from pathlib import Path
 
 import socketio
@@ -24,8 +27,15 @@ from api import (
 )
 from core.config import get_allowed_origins, get_model_config
 from database import init_db
-from realtime.socket_handlers import create_socket_server
-from services.attention_model import load_attention_model
+from realtime.socket_handlers import (
+    create_socket_server,
+    start_dashboard_broadcaster,
+    stop_dashboard_broadcaster,
+)
+from services.attention_batcher import AttentionBatcher
+from services.attention_model import inference_autocast_dtype, load_attention_model
+from services.metrics_buffer import AttentionMetricBuffer
+from services.transcription import WHISPER_POOL, warm_up_whisper
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("attention-api")
@@ -69,10 +79,47 @@ except ImportError as exc:
     logger.warning("Instale as dependências do LangChain para habilitar IA v2")
 
 
+def _raise_nofile_limit(target: int = 65535):
+    """Sobe o limite de descritores (padrão 1024 no Linux) até o teto permitido"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    new_soft = target if hard == resource.RLIM_INFINITY else min(target, hard)
+    if new_soft > soft:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+        except (ValueError, OSError) as exc:
+            logger.warning("Não foi possível ajustar RLIMIT_NOFILE: %s", exc)
+            return
+    logger.info("Limite de arquivos abertos: %d", max(soft, new_soft))
+
+
 @app.on_event("startup")
 async def startup_event():
+    _raise_nofile_limit()
     init_db()
     logger.info("Banco de dados inicializado")
+    app.state.batcher = AttentionBatcher(
+        MODEL, DEVICE, autocast_dtype=inference_autocast_dtype(DEVICE)
+    )
+    app.state.batcher.start()
+    app.state.metric_buffer = AttentionMetricBuffer()
+    app.state.metric_buffer.start()
+    start_dashboard_broadcaster()
+    try:
+        await asyncio.get_running_loop().run_in_executor(WHISPER_POOL, warm_up_whisper)
+    except Exception as exc:
+        # Sem Whisper só /transcribe é afetado; o modelo é carregado no primeiro uso
+        logger.warning("Não foi possível pré-carregar o Whisper: %s", exc)
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await app.state.batcher.stop()
+    await app.state.metric_buffer.stop()
+    await stop_dashboard_broadcaster()
 
 
 app.state.model = MODEL
@@ -86,6 +133,23 @@ app.state.sio = sio
 socket_app = socketio.ASGIApp(sio, app)
 
 
+# Com mais de um worker, configure REDIS_URL para o socketio propagar os
+# eventos entre processos (e use sticky sessions no balanceador)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# Fila de conexões pendentes (limitada também por net.core.somaxconn) e
+# máximo de conexões/tarefas simultâneas antes de responder 503
+SOCKET_BACKLOG = 2048
+LIMIT_CONCURRENCY = 2000
+
 if __name__ == "__main__":
-    uvicorn.run(socket_app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:socket_app" if WEB_WORKERS > 1 else socket_app,
+        host="0.0.0.0",
+        port=8000,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop não roda no Windows
+        http="httptools",
+        workers=WEB_WORKERS,
+        backlog=SOCKET_BACKLOG,
+        limit_concurrency=LIMIT_CONCURRENCY,
+    )
 
@@ -1,23 +1,76 @@
+import asyncio
 import logging
+import time
 from datetime import datetime
-from typing import Dict
+from typing import Dict, List, Optional, Set, Tuple
 
 import socketio
 
+try:
+    import orjson
+
+    ORJSON_DISPONIVEL = True
+except ImportError:
+    ORJSON_DISPONIVEL = False
+
 from database import ClassSession, SessionParticipant, SessionLocal
+from services.dashboard_cache import REDIS_URL, invalidate_dashboard
 
 logger = logging.getLogger("attention-api.realtime")
 
+# Sala -> {sid: {"name": ...}}. A filiação em si o socketio também guarda,
+# mas os nomes (e as rotas HTTP do dashboard) dependem deste dicionário.
 rooms: Dict[str, Dict[str, Dict]] = {}
 room_attention_data: Dict[str, Dict[str, Dict]] = {}
+# Índice reverso sid -> salas em que o cliente entrou
+sid_index: Dict[str, Set[str]] = {}
 sio: socketio.AsyncServer
 
+# Salas com mudanças ainda não enviadas ao dashboard. As atualizações são
+# agrupadas: no máximo um "dashboard-update" por sala a cada intervalo.
+DASHBOARD_BROADCAST_INTERVAL = 0.25  # segundos
+dirty_rooms: Set[str] = set()
+_dirty_event: Optional[asyncio.Event] = None
+_broadcaster_task: Optional[asyncio.Task] = None
+
+# Última atualização de atenção emitida por sid: (is_attentive, prob, instante).
+# Os frames chegam a ~1 Hz: um aluno com o mesmo rótulo e prob_attentive a
+# menos de ATTENTION_PROB_THRESHOLD do último valor emitido só é reenviado
+# a cada ATTENTION_HEARTBEAT segundos.
+ATTENTION_HEARTBEAT = 5.0  # segundos
+ATTENTION_PROB_THRESHOLD = 0.05
+_last_attention_emit: Dict[str, Tuple[Optional[bool], float, float]] = {}
+
+# Timestamp das atualizações de atenção, reformatado no máximo a cada 100 ms
+_attention_ts = {"at": float("-inf"), "value": ""}
+
+# Dicts de participante reaproveitados entre broadcasts (mutados no lugar).
+# Seguro porque só a task do broadcaster monta e emite esses payloads.
+_participant_pool: Dict[str, List[Dict]] = {}
+_NO_ATTENTION: Dict = {}
+
+
+class _OrjsonCodec:
+    """Interface json (dumps/loads) usada pelo socketio, implementada com orjson"""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    @staticmethod
+    def loads(data, *args, **kwargs):
+        return orjson.loads(data)
+
 
 def create_socket_server(allowed_origins):
     global sio
+    # Com Redis, emits para uma sala alcançam clientes conectados em outros workers
+    client_manager = socketio.AsyncRedisManager(REDIS_URL) if REDIS_URL else None
     sio = socketio.AsyncServer(
         async_mode="asgi",
+        client_manager=client_manager,
         cors_allowed_origins=allowed_origins,
+        json=_OrjsonCodec if ORJSON_DISPONIVEL else None,
         logger=True,
         engineio_logger=False,
     )
@@ -33,23 +86,19 @@ def _register_handlers():
     @sio.event
     async def disconnect(sid):
         logger.info("Cliente desconectado: %s", sid)
-        for room_code in list(rooms.keys()):
-            for user_id in list(rooms[room_code].keys()):
-                if rooms[room_code][user_id].get("sid") == sid:
-                    del rooms[room_code][user_id]
-                    if (
-                        room_code in room_attention_data
-                        and user_id in room_attention_data[room_code]
-                    ):
-                        del room_attention_data[room_code][user_id]
-                    await sio.emit(
-                        "user-left", {"id": user_id}, room=room_code, skip_sid=sid
-                    )
-                    await _broadcast_dashboard_update(room_code)
-                    logger.info("User %s left room %s", user_id, room_code)
-            if not rooms[room_code]:
+        _last_attention_emit.pop(sid, None)
+        for room_code in sid_index.pop(sid, ()):
+            room_users = rooms.get(room_code)
+            if room_users is None or room_users.pop(sid, None) is None:
+                continue
+            room_attention_data.get(room_code, {}).pop(sid, None)
+            await sio.emit("user-left", {"id": sid}, room=room_code, skip_sid=sid)
+            _mark_dashboard_dirty(room_code)
+            logger.info("User %s left room %s", sid, room_code)
+            if not room_users:
                 del rooms[room_code]
                 room_attention_data.pop(room_code, None)
+                _participant_pool.pop(room_code, None)
 
     @sio.event
     async def join_room(sid, data):
@@ -69,48 +118,18 @@ def _register_handlers():
             for uid, udata in rooms[room].items()
         ]
 
-        rooms[room][user_id] = {"name": name, "sid": sid, "user_db_id": user_db_id}
+        rooms[room][user_id] = {"name": name}
+        sid_index.setdefault(sid, set()).add(room)
 
         if user_db_id:
-            db = SessionLocal()
-            try:
-                session = (
-                    db.query(ClassSession)
-                    .filter(ClassSession.room_code == room, ClassSession.is_active.is_(True))
-                    .first()
-                )
-                if session:
-                    existing_participant = (
-                        db.query(SessionParticipant)
-                        .filter(
-                            SessionParticipant.session_id == session.id,
-                            SessionParticipant.user_id == user_db_id,
-                        )
-                        .first()
-                    )
-                    if not existing_participant:
-                        participant = SessionParticipant(
-                            session_id=session.id,
-                            user_id=user_db_id,
-                        )
-                        db.add(participant)
-                        db.commit()
-                        logger.info(
-                            "Adicionado usuário %s como participante da sessão %s",
-                            user_db_id,
-                            session.id,
-                        )
-            except Exception as exc:
-                logger.error("Erro ao adicionar participante: %s", exc)
-            finally:
-                db.close()
+            await asyncio.to_thread(_register_participant, room, user_db_id)
 
         await sio.emit("existing-users", {"users": existing_users}, room=sid)
         await sio.emit(
             "user-joined", {"id": user_id, "name": name}, room=room, skip_sid=sid
         )
-        await _broadcast_dashboard_update(room)
-        logger.info("Sala %s agora tem %d usuários", room, len(rooms[room]))
+        _mark_dashboard_dirty(room)
+        logger.info("Sala %s agora tem %d usuários", room, len(rooms.get(room, {})))
 
     @sio.event
     async def attention_update(sid, data):
@@ -118,12 +137,31 @@ def _register_handlers():
         user_name = data.get("name", "Anônimo")
 
         if room_code and room_code in room_attention_data:
+            # Estado estável: só renova o timestamp, sem emitir
+            is_attentive = data.get("is_attentive")
+            prob_attentive = data.get("prob_attentive", 0)
+            now = time.monotonic()
+            previous = room_attention_data[room_code].get(sid)
+            last_emit = _last_attention_emit.get(sid)
+            if (
+                previous is not None
+                and last_emit is not None
+                and isinstance(prob_attentive, (int, float))
+                and last_emit[0] == is_attentive
+                and abs(prob_attentive - last_emit[1]) < ATTENTION_PROB_THRESHOLD
+                and now - last_emit[2] < ATTENTION_HEARTBEAT
+            ):
+                previous["timestamp"] = _attention_timestamp()
+                return
+            if isinstance(prob_attentive, (int, float)):
+                _last_attention_emit[sid] = (is_attentive, prob_attentive, now)
+
             room_attention_data[room_code][sid] = {
                 "is_attentive": data.get("is_attentive"),
                 "confidence": data.get("confidence", 0),
-                "prob_attentive": data.get("prob_attentive", 0),
+                "prob_attentive": prob_attentive,
                 "prob_inattentive": data.get("prob_inattentive", 0),
-                "timestamp": datetime.utcnow().isoformat(),
+                "timestamp": _attention_timestamp(),
             }
 
             await sio.emit(
@@ -132,37 +170,31 @@ def _register_handlers():
                     "odId": sid,
                     "name": user_name,
                     "is_attentive": data.get("is_attentive"),
-                    "prob_attentive": data.get("prob_attentive", 0),
+                    "prob_attentive": prob_attentive,
                     "prob_inattentive": data.get("prob_inattentive", 0),
                 },
                 room=room_code,
                 skip_sid=sid,
             )
-            await _broadcast_dashboard_update(room_code)
+            _mark_dashboard_dirty(room_code)
 
     @sio.event
     async def chat_message(sid, data):
         logger.info("Chat message from %s: %s", sid, data)
         room = data.get("room")
-        if room and room in rooms:
+        if not (room and room in rooms):
+            room = _room_of(sid)
+        if room:
             await sio.emit("chat_message", data, room=room, skip_sid=sid)
-            return
-
-        for room_code, users in rooms.items():
-            for user_id, user_info in users.items():
-                if user_info.get("sid") == sid:
-                    await sio.emit("chat_message", data, room=room_code, skip_sid=sid)
-                    return
 
     @sio.event
     async def offer(sid, data):
         target = data.get("target")
         offer = data.get("offer")
         sender_name = "Anônimo"
-        for room_code, users in rooms.items():
-            if sid in users:
-                sender_name = users[sid].get("name", "Anônimo")
-                break
+        room_code = _room_of(sid)
+        if room_code:
+            sender_name = rooms[room_code][sid].get("name", "Anônimo")
         await sio.emit("offer", {"from": sid, "offer": offer, "name": sender_name}, to=target)
 
     @sio.event
@@ -192,50 +224,144 @@ def _register_handlers():
             "text": data.get("text"),
             "timestamp": data.get("timestamp"),
         }
-        if room and room in rooms:
+        if not (room and room in rooms):
+            room = _room_of(sid)
+        if room:
             await sio.emit("transcript_update", payload, room=room, skip_sid=sid)
-            return
 
-        for room_code, users in rooms.items():
-            for user_id, user_info in users.items():
-                if user_info.get("sid") == sid:
-                    await sio.emit("transcript_update", payload, room=room_code, skip_sid=sid)
-                    return
+
+def _register_participant(room: str, user_db_id):
+    """Registra o usuário como participante da sessão ativa (executa fora do loop)"""
+    db = SessionLocal()
+    try:
+        session = (
+            db.query(ClassSession)
+            .filter(ClassSession.room_code == room, ClassSession.is_active.is_(True))
+            .first()
+        )
+        if session:
+            existing_participant = (
+                db.query(SessionParticipant)
+                .filter(
+                    SessionParticipant.session_id == session.id,
+                    SessionParticipant.user_id == user_db_id,
+                )
+                .first()
+            )
+            if not existing_participant:
+                participant = SessionParticipant(
+                    session_id=session.id,
+                    user_id=user_db_id,
+                )
+                db.add(participant)
+                db.commit()
+                logger.info(
+                    "Adicionado usuário %s como participante da sessão %s",
+                    user_db_id,
+                    session.id,
+                )
+    except Exception as exc:
+        logger.error("Erro ao adicionar participante: %s", exc)
+    finally:
+        db.close()
+
+
+def _attention_timestamp() -> str:
+    now = time.monotonic()
+    if now - _attention_ts["at"] >= 0.1:
+        _attention_ts["at"] = now
+        _attention_ts["value"] = datetime.utcnow().isoformat()
+    return _attention_ts["value"]
+
+
+def _room_of(sid: str) -> Optional[str]:
+    """Uma sala em que o sid está, pelo índice reverso"""
+    for room_code in sid_index.get(sid, ()):
+        if sid in rooms.get(room_code, {}):
+            return room_code
+    return None
+
+
+def _mark_dashboard_dirty(room_code: str):
+    dirty_rooms.add(room_code)
+    if _dirty_event is not None:
+        _dirty_event.set()
+
+
+def start_dashboard_broadcaster():
+    """Inicia a task que envia os dashboards pendentes (chamar no startup)"""
+    global _dirty_event, _broadcaster_task
+    if _broadcaster_task is None:
+        _dirty_event = asyncio.Event()
+        if dirty_rooms:
+            _dirty_event.set()
+        _broadcaster_task = asyncio.create_task(_dashboard_broadcaster())
+
+
+async def stop_dashboard_broadcaster():
+    global _broadcaster_task
+    if _broadcaster_task is not None:
+        _broadcaster_task.cancel()
+        try:
+            await _broadcaster_task
+        except asyncio.CancelledError:
+            pass
+        _broadcaster_task = None
+
+
+async def _dashboard_broadcaster():
+    while True:
+        await _dirty_event.wait()
+        _dirty_event.clear()
+        pending = list(dirty_rooms)
+        dirty_rooms.clear()
+        for room_code in pending:
+            if room_code not in rooms:
+                continue
+            try:
+                await _broadcast_dashboard_update(room_code)
+            except Exception as exc:
+                logger.error("Erro ao enviar dashboard da sala %s: %s", room_code, exc)
+        await asyncio.sleep(DASHBOARD_BROADCAST_INTERVAL)
 
 
 async def _broadcast_dashboard_update(room_code: str):
+    await invalidate_dashboard(room_code)
+    await sio.emit("dashboard-update", _dashboard_payload(room_code), room=room_code)
+
+
+def _dashboard_payload(room_code: str) -> Dict:
+    """Monta o payload do dashboard da sala"""
     attention_data = room_attention_data.get(room_code, {})
     room_users = rooms.get(room_code, {})
 
-    participants_info = []
-    for user_id, user_info in room_users.items():
-        user_attention = attention_data.get(user_id, {})
-        participants_info.append(
-            {
-                "id": user_id,
-                "name": user_info.get("name", "Anônimo"),
-                "is_attentive": user_attention.get("is_attentive"),
-                "confidence": user_attention.get("confidence", 0),
-                "prob_attentive": user_attention.get("prob_attentive", 0),
-                "prob_inattentive": user_attention.get("prob_inattentive", 0),
-            }
-        )
-
-    total = len(participants_info)
-    attentive = sum(1 for p in participants_info if p["is_attentive"] is True)
-
-    await sio.emit(
-        "dashboard-update",
-        {
-            "room_code": room_code,
-            "stats": {
-                "total": total,
-                "attentive": attentive,
-                "inattentive": total - attentive,
-                "attention_rate": round((attentive / total * 100) if total else 0, 1),
-            },
-            "participants": participants_info,
+    participants_info = _participant_pool.setdefault(room_code, [])
+    total = len(room_users)
+    del participants_info[total:]
+    while len(participants_info) < total:
+        participants_info.append({})
+
+    attentive = 0
+    for entry, (user_id, user_info) in zip(participants_info, room_users.items()):
+        user_attention = attention_data.get(user_id, _NO_ATTENTION)
+        is_attentive = user_attention.get("is_attentive")
+        entry["id"] = user_id
+        entry["name"] = user_info.get("name", "Anônimo")
+        entry["is_attentive"] = is_attentive
+        entry["confidence"] = user_attention.get("confidence", 0)
+        entry["prob_attentive"] = user_attention.get("prob_attentive", 0)
+        entry["prob_inattentive"] = user_attention.get("prob_inattentive", 0)
+        if is_attentive is True:
+            attentive += 1
+
+    payload = {
+        "room_code": room_code,
+        "stats": {
+            "total": total,
+            "attentive": attentive,
+            "inattentive": total - attentive,
+            "attention_rate": round((attentive / total * 100) if total else 0, 1),
         },
-        room=room_code,
-    )
-
+        "participants": participants_info,
+    }
+    return payload
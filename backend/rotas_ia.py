@@ -2,14 +2,19 @@
 Rotas da API para Assistente de IA com suporte ao LangChain
 """
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, select
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
+import itertools
 import tempfile
 import os
 import logging
 
 # Limite de tamanho de arquivo: 10MB (para evitar segfault com PDFs grandes)
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB em bytes
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
 from database import get_db, User, ClassSession, SessionParticipant
 from auth import get_current_user, get_current_teacher
@@ -21,7 +26,11 @@ from assistente_ia import (
     perguntar_assistente_ia_langchain,
     obter_historico_conversa,
     limpar_historico_conversa,
-    LANGCHAIN_DISPONIVEL
+    buscar_documentos_relevantes,
+    montar_historico_chat,
+    transmitir_resposta_ia,
+    LANGCHAIN_DISPONIVEL,
+    LIMITE_HISTORICO_CHAT
 )
 
 router = APIRouter(prefix="/ai/v2", tags=["Assistente de IA V2"])
@@ -89,23 +98,21 @@ async def definir_contexto_ia_v2(
 
         # Processa arquivos enviados
         for file in files:
-            # Lê conteúdo do arquivo
-            conteudo_bytes = await file.read()
-
-            # Valida tamanho do arquivo
-            tamanho_mb = len(conteudo_bytes) / (1024 * 1024)
-            if len(conteudo_bytes) > MAX_FILE_SIZE:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"Arquivo '{file.filename}' muito grande ({tamanho_mb:.1f}MB). Máximo permitido: 10MB"
-                )
-
-            # Salva em arquivo temporário
+            # Copia o upload para arquivo temporário em blocos, validando o tamanho
             sufixo = f".{file.filename.split('.')[-1]}"
+            tamanho = 0
             with tempfile.NamedTemporaryFile(delete=False, suffix=sufixo) as tmp:
-                tmp.write(conteudo_bytes)
                 arquivos_temp.append((tmp.name, file.filename))
-
+                while bloco := await file.read(UPLOAD_CHUNK_SIZE):
+                    tamanho += len(bloco)
+                    if tamanho > MAX_FILE_SIZE:
+                        raise HTTPException(
+                            status_code=413,
+                            detail=f"Arquivo '{file.filename}' muito grande. Máximo permitido: 10MB"
+                        )
+                    tmp.write(bloco)
+
+            tamanho_mb = tamanho / (1024 * 1024)
             logger.info(f"Arquivo recebido: {file.filename} ({tamanho_mb:.2f}MB)")
 
         # Usa LangChain se disponível
@@ -114,14 +121,7 @@ async def definir_contexto_ia_v2(
             logger.info(f"Processando {len(arquivos_temp)} arquivo(s)...")
 
             # Processamento pode demorar - executar em thread separada
-            import asyncio
-            from concurrent.futures import ThreadPoolExecutor
-
-            executor = ThreadPoolExecutor(max_workers=1)
-            loop = asyncio.get_event_loop()
-
-            contexto_ia = await loop.run_in_executor(
-                executor,
+            contexto_ia = await asyncio.to_thread(
                 salvar_contexto_ia_langchain,
                 db,
                 sessao.id,
@@ -139,6 +139,8 @@ async def definir_contexto_ia_v2(
             "updated_at": contexto_ia.updated_at.isoformat()
         }
 
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -186,42 +188,58 @@ async def verificar_contexto_ia_v2(
     }
 
 
-@router.post("/ask")
-async def perguntar_ia_v2(
-    room_code: str = Form(...),
-    question: str = Form(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
-):
-    """Faz pergunta ao assistente de IA"""
-    print(f"[DEBUG] /ai/v2/ask - room_code: {room_code}, question: {question[:50]}...")
-
-    sessao = db.query(ClassSession).filter(
-        ClassSession.room_code == room_code,
-        ClassSession.is_active == True
+def _obter_sessao_para_pergunta(db: Session, room_code: str, usuario: User) -> ClassSession:
+    """Busca a sessão ativa e verifica se o usuário é professor ou participante"""
+    # Sessão e participação do usuário em uma única consulta (outer join)
+    linha = db.execute(
+        select(ClassSession, SessionParticipant.id)
+        .outerjoin(
+            SessionParticipant,
+            and_(
+                SessionParticipant.session_id == ClassSession.id,
+                SessionParticipant.user_id == usuario.id
+            )
+        )
+        .where(
+            ClassSession.room_code == room_code,
+            ClassSession.is_active == True
+        )
     ).first()
 
-    if not sessao:
-        print(f"[DEBUG] Sessão não encontrada: {room_code}")
+    if linha is None:
+        logger.debug("Sessão não encontrada: %s", room_code)
         raise HTTPException(status_code=404, detail="Sessão não encontrada")
 
+    sessao, id_participacao = linha
+
     # Verifica permissão
-    eh_professor = sessao.teacher_id == current_user.id
-    eh_participante = db.query(SessionParticipant).filter(
-        SessionParticipant.session_id == sessao.id,
-        SessionParticipant.user_id == current_user.id
-    ).first() is not None
+    eh_professor = sessao.teacher_id == usuario.id
+    eh_participante = id_participacao is not None
 
-    print(f"[DEBUG] eh_professor: {eh_professor}, eh_participante: {eh_participante}")
+    logger.debug("eh_professor: %s, eh_participante: %s", eh_professor, eh_participante)
 
     if not (eh_professor or eh_participante):
-        print(f"[DEBUG] Acesso negado para user_id: {current_user.id}")
+        logger.debug("Acesso negado para user_id: %s", usuario.id)
         raise HTTPException(status_code=403, detail="Acesso negado")
 
+    return sessao
+
+
+@router.post("/ask")
+async def perguntar_ia_v2(
+    room_code: str = Form(...),
+    question: str = Form(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Faz pergunta ao assistente de IA"""
+    logger.debug("/ai/v2/ask - room_code: %s, question: %.50s...", room_code, question)
+
+    sessao = _obter_sessao_para_pergunta(db, room_code, current_user)
+
     # Pergunta à IA
-    print(f"[DEBUG] Chamando perguntar_assistente_ia_langchain...")
     resultado = perguntar_assistente_ia_langchain(db, sessao.id, current_user.id, question)
-    print(f"[DEBUG] Resultado: success={resultado.get('success')}, error={resultado.get('error')}")
+    logger.debug("Resultado: success=%s, error=%s", resultado.get("success"), resultado.get("error"))
 
     if not resultado.get("success"):
         raise HTTPException(
@@ -232,6 +250,56 @@ async def perguntar_ia_v2(
     return resultado
 
 
+@router.post("/ask/stream")
+async def perguntar_ia_v2_stream(
+    room_code: str = Form(...),
+    question: str = Form(...),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Faz pergunta ao assistente de IA e transmite a resposta em texto puro"""
+    sessao = _obter_sessao_para_pergunta(db, room_code, current_user)
+
+    if not LANGCHAIN_DISPONIVEL:
+        raise HTTPException(status_code=400, detail="LangChain não está disponível no sistema")
+
+    if not obter_contexto_ia(db, sessao.id):
+        raise HTTPException(
+            status_code=400,
+            detail="Nenhum material foi fornecido pelo professor para esta aula."
+        )
+
+    # Busca de chunks e leitura do histórico são independentes: rodam em paralelo
+    documentos, historico = await asyncio.gather(
+        asyncio.to_thread(buscar_documentos_relevantes, sessao.id, question),
+        asyncio.to_thread(
+            obter_historico_conversa, db, sessao.id, current_user.id, LIMITE_HISTORICO_CHAT
+        ),
+    )
+
+    if documentos is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Erro ao carregar materiais. Por favor, peça ao professor para reenviar."
+        )
+
+    gerador = transmitir_resposta_ia(
+        sessao.id, current_user.id, question, documentos, montar_historico_chat(historico)
+    )
+    # Busca o primeiro pedaço antes de responder: falhas do LLM nesse ponto
+    # ainda viram um status de erro, em vez de um 200 com corpo vazio
+    try:
+        primeiro = await asyncio.to_thread(next, gerador, None)
+    except Exception as e:
+        logger.error(f"Erro ao iniciar streaming da resposta: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao processar pergunta")
+
+    return StreamingResponse(
+        itertools.chain([primeiro], gerador) if primeiro is not None else gerador,
+        media_type="text/plain; charset=utf-8"
+    )
+
+
 @router.get("/history/{room_code}")
 async def obter_historico_ia_v2(
     room_code: str,
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger("attention-api.batcher")
+
+MAX_BATCH = int(os.getenv("ATTENTION_MAX_BATCH", "16"))
+MAX_WAIT_MS = float(os.getenv("ATTENTION_MAX_WAIT_MS", "5"))
+
+
+class AttentionBatcher:
+    """
+    Agrupa requisições de predição concorrentes em um único forward do modelo.
+
+    Cada chamada a `predict` enfileira um tensor (C, H, W) e aguarda sua linha
+    de probabilidades; uma task em segundo plano junta até `max_batch` itens
+    que chegarem dentro de `max_wait_ms` e executa um único forward.
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        device: torch.device,
+        max_batch: int = MAX_BATCH,
+        max_wait_ms: float = MAX_WAIT_MS,
+        autocast_dtype: Optional[torch.dtype] = None,
+    ):
+        self.model = model
+        self.device = device
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.dtype = next(model.parameters()).dtype
+        self.autocast_dtype = autocast_dtype
+        self.queue: "asyncio.Queue[Tuple[torch.Tensor, asyncio.Future]]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def predict(self, img_tensor: torch.Tensor) -> torch.Tensor:
+        """Retorna as probabilidades (softmax) de uma imagem, na CPU."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((img_tensor, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[torch.Tensor, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            # Itens já enfileirados entram sem criar uma task de espera
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            batch = [(tensor, future) for tensor, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                probs = await asyncio.to_thread(
+                    self._forward, [tensor for tensor, _ in batch]
+                )
+            except Exception as exc:
+                logger.error("Erro na inferência em lote: %s", exc)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            for (_, future), row in zip(batch, probs):
+                if not future.done():
+                    future.set_result(row)
+
+    def _forward(self, tensors: List[torch.Tensor]) -> torch.Tensor:
+        if any(tensor.device != tensors[0].device for tensor in tensors):
+            # Lote misto (CPU e GPU): torch.stack exige um único device
+            tensors = [tensor.to(self.device, non_blocking=True) for tensor in tensors]
+        batch = torch.stack(tensors)
+        if self.device.type == "cuda" and not batch.is_cuda:
+            batch = batch.pin_memory()
+        batch = batch.to(self.device, dtype=self.dtype, non_blocking=True)
+        batch = batch.contiguous(memory_format=torch.channels_last)
+
+        with torch.inference_mode(), torch.autocast(
+            device_type=self.device.type,
+            dtype=self.autocast_dtype,
+            enabled=self.autocast_dtype is not None,
+        ):
+            output = self.model(batch)
+        return torch.softmax(output.float(), dim=1).cpu()
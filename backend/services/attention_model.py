@@ -1,10 +1,21 @@
+import os
+from io import BytesIO
 from pathlib import Path
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Optional, Tuple
 
-import timm
 import torch
 import torch.nn as nn
-from torchvision import transforms
+from PIL import Image, UnidentifiedImageError
+from torchvision.io import ImageReadMode, decode_image, decode_jpeg
+from torchvision.transforms import v2
+
+# torch.compile do modelo na GPU (desative com ATTENTION_TORCH_COMPILE=0)
+TORCH_COMPILE = os.getenv("ATTENTION_TORCH_COMPILE", "1") == "1"
+# Na CPU: autocast bfloat16 em vez da quantização int8 (vale a pena só em
+# CPUs com suporte nativo a bf16, como AVX512-BF16/AMX)
+CPU_BF16 = os.getenv("ATTENTION_CPU_BF16", "0") == "1"
+# Limite de pixels por frame (proteção contra "decompression bombs")
+MAX_FRAME_PIXELS = int(os.getenv("ATTENTION_MAX_FRAME_PIXELS", str(4096 * 4096)))
 
 
 class LightAttentionModel(nn.Module):
@@ -21,6 +32,8 @@ class LightAttentionModel(nn.Module):
     ):
         super().__init__()
 
+        import timm  # import tardio: só quem constrói o modelo paga o custo
+
         self.cnn = timm.create_model(
             backbone,
             pretrained=False,
@@ -33,7 +46,6 @@ class LightAttentionModel(nn.Module):
             features = self.cnn(dummy)
             self.feature_size = features.shape[1]
 
-        self.pool = nn.AdaptiveAvgPool2d(1)
         self.lstm = nn.LSTM(
             input_size=self.feature_size,
             hidden_size=hidden_size,
@@ -53,8 +65,10 @@ class LightAttentionModel(nn.Module):
 
         batch_size, seq_len = x.shape[0], x.shape[1]
         x = x.view(batch_size * seq_len, *x.shape[2:])
-        features = self.cnn(x)
-        features = self.pool(features).squeeze(-1).squeeze(-1)
+        # Média espacial direto em (B*T, C). O pooling fica fora do timm porque
+        # na MobileNetV3 o conv_head roda depois do pool: global_pool="avg"
+        # mudaria a ordem das operações usada no treino.
+        features = self.cnn(x).mean(dim=(2, 3))
         features = features.view(batch_size, seq_len, -1)
 
         lstm_out, _ = self.lstm(features)
@@ -63,16 +77,44 @@ class LightAttentionModel(nn.Module):
         return self.classifier(lstm_out)
 
 
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+
 def create_image_transform(img_size: int):
-    return transforms.Compose(
+    """Transformações sobre tensores uint8 (C, H, W), no device em que estiverem"""
+    return v2.Compose(
         [
-            transforms.Resize((img_size, img_size)),
-            transforms.ToTensor(),
-            transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+            v2.Resize((img_size, img_size), antialias=True),
+            v2.ToDtype(torch.float32, scale=True),
+            v2.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
         ]
     )
 
 
+def decode_frame(data: bytes, device: torch.device) -> torch.Tensor:
+    """
+    Decodifica a imagem enviada para um tensor uint8 RGB (C, H, W) em `device`.
+    JPEG na GPU usa o nvJPEG; os demais formatos são decodificados na CPU e
+    copiados para o device, para que todo lote do batcher fique no mesmo
+    device. Levanta RuntimeError ou ValueError quando a imagem é inválida ou
+    passa de MAX_FRAME_PIXELS.
+    """
+    # O PIL só lê o cabeçalho aqui: as dimensões são checadas antes de
+    # qualquer buffer ser alocado para os pixels
+    try:
+        with Image.open(BytesIO(data)) as header:
+            width, height = header.size
+    except (UnidentifiedImageError, Image.DecompressionBombError) as exc:
+        raise ValueError(str(exc)) from exc
+    if width * height > MAX_FRAME_PIXELS:
+        raise ValueError(f"Imagem grande demais: {width}x{height}")
+
+    encoded = torch.frombuffer(bytearray(data), dtype=torch.uint8)
+    if device.type == "cuda" and data.startswith(JPEG_MAGIC):
+        return decode_jpeg(encoded, mode=ImageReadMode.RGB, device=device)
+    return decode_image(encoded, mode=ImageReadMode.RGB).to(device, non_blocking=True)
+
+
 def load_attention_model(
     config: Dict[str, Any],
     weights_path: Path,
@@ -80,6 +122,10 @@ def load_attention_model(
 ) -> Tuple[LightAttentionModel, Any]:
     """
     Constrói e carrega o modelo de atenção com os pesos treinados.
+    Na GPU o modelo roda em FP16 (compilado com torch.compile); na CPU, com
+    quantização dinâmica int8 ou, com ATTENTION_CPU_BF16=1, em FP32 sob
+    autocast bf16 (ver `inference_autocast_dtype`). Os pesos ficam em
+    channels_last.
     """
     model = LightAttentionModel(
         backbone=config["backbone"],
@@ -89,9 +135,28 @@ def load_attention_model(
     )
     state_dict = torch.load(weights_path, map_location=device)
     model.load_state_dict(state_dict)
-    model.to(device)
+    model.to(device, memory_format=torch.channels_last)
     model.eval()
 
+    if device.type == "cuda":
+        model.half()
+        if TORCH_COMPILE and hasattr(torch, "compile"):
+            # Modo padrão: "reduce-overhead" usa CUDA graphs, que são por thread,
+            # e o forward roda em threads diferentes do executor.
+            model = torch.compile(model)
+    elif not CPU_BF16:
+        # Quantização dinâmica int8 das camadas suportadas (LSTM + classifier)
+        model = torch.ao.quantization.quantize_dynamic(
+            model, {nn.Linear, nn.LSTM}, dtype=torch.qint8
+        )
+
     transform = create_image_transform(config["img_size"])
     return model, transform
 
+
+
+def inference_autocast_dtype(device: torch.device) -> Optional[torch.dtype]:
+    """dtype de autocast para o forward, ou None quando não se aplica"""
+    if device.type == "cpu" and CPU_BF16:
+        return torch.bfloat16
+    return None
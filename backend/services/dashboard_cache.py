@@ -0,0 +1,76 @@
+"""
+Cache curto (Redis) da resposta de /dashboard/session/{room_code}.
+
+Se REDIS_URL não estiver configurada, ou o Redis estiver indisponível,
+todas as funções viram no-op e o dashboard é calculado normalmente.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, Optional
+
+try:
+    import redis
+    import redis.asyncio as aioredis
+
+    REDIS_DISPONIVEL = True
+except ImportError:
+    REDIS_DISPONIVEL = False
+
+logger = logging.getLogger("attention-api.dashboard_cache")
+
+REDIS_URL = os.getenv("REDIS_URL")
+DASHBOARD_CACHE_TTL = 2  # segundos
+
+_client = None
+_async_client = None
+
+
+def _dashboard_key(room_code: str) -> str:
+    return f"dash:{room_code}"
+
+
+def _get_client():
+    global _client
+    if _client is None and REDIS_DISPONIVEL and REDIS_URL:
+        _client = redis.Redis.from_url(REDIS_URL)
+    return _client
+
+
+def _get_async_client():
+    global _async_client
+    if _async_client is None and REDIS_DISPONIVEL and REDIS_URL:
+        _async_client = aioredis.Redis.from_url(REDIS_URL)
+    return _async_client
+
+
+def get_cached_dashboard(room_code: str) -> Optional[Dict[str, Any]]:
+    client = _get_client()
+    if client is None:
+        return None
+    try:
+        cached = client.get(_dashboard_key(room_code))
+    except redis.RedisError as exc:
+        logger.warning("Redis indisponível ao ler dashboard: %s", exc)
+        return None
+    return json.loads(cached) if cached else None
+
+
+def set_cached_dashboard(room_code: str, payload: Dict[str, Any]) -> None:
+    client = _get_client()
+    if client is None:
+        return
+    try:
+        client.setex(_dashboard_key(room_code), DASHBOARD_CACHE_TTL, json.dumps(payload))
+    except redis.RedisError as exc:
+        logger.warning("Redis indisponível ao gravar dashboard: %s", exc)
+
+
+async def invalidate_dashboard(room_code: str) -> None:
+    client = _get_async_client()
+    if client is None:
+        return
+    try:
+        await client.delete(_dashboard_key(room_code))
+    except redis.RedisError as exc:
+        logger.warning("Redis indisponível ao invalidar dashboard: %s", exc)
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from database import AttentionMetric, SessionLocal
+
+logger = logging.getLogger("attention-api.metrics")
+
+FLUSH_INTERVAL = 1.0  # segundos
+FLUSH_MAX_ROWS = 500
+
+
+def _insert_metrics(rows: List[Dict[str, Any]]) -> int:
+    """
+    Grava as métricas em lote e devolve quantas linhas foram descartadas.
+    Se o lote falhar (ex.: um user_id inexistente viola a FK), regrava linha
+    a linha para que só as linhas inválidas se percam.
+    """
+    db = SessionLocal()
+    try:
+        try:
+            db.bulk_insert_mappings(AttentionMetric, rows)
+            db.commit()
+            return 0
+        except SQLAlchemyError as exc:
+            db.rollback()
+            logger.warning("Lote de %d métricas falhou, gravando uma a uma: %s", len(rows), exc)
+
+        dropped = 0
+        for row in rows:
+            try:
+                db.bulk_insert_mappings(AttentionMetric, [row])
+                db.commit()
+            except SQLAlchemyError:
+                db.rollback()
+                dropped += 1
+        return dropped
+    finally:
+        db.close()
+
+
+class AttentionMetricBuffer:
+    """
+    Acumula métricas de atenção em memória e as grava em lote.
+
+    O flush acontece a cada `flush_interval` segundos ou quando o buffer
+    atinge `max_rows` linhas. Em caso de queda do processo, no máximo o
+    último intervalo de métricas é perdido.
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, max_rows: int = FLUSH_MAX_ROWS):
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._rows: Deque[Dict[str, Any]] = deque()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, row: Dict[str, Any]):
+        self._rows.append(row)
+        if len(self._rows) >= self.max_rows:
+            self._full.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        rows = []
+        while self._rows:
+            rows.append(self._rows.popleft())
+        if not rows:
+            return
+        try:
+            dropped = await asyncio.to_thread(_insert_metrics, rows)
+        except Exception as exc:
+            logger.error("Erro ao gravar %d métricas de atenção: %s", len(rows), exc)
+            return
+        if dropped:
+            logger.error("%d de %d métricas de atenção descartadas (linhas inválidas)", dropped, len(rows))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
@@ -1,13 +1,72 @@
 import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
+from typing import Any, Dict
 
-import whisper
+import numpy as np
+import torch
 
 logger = logging.getLogger("attention-api.transcription")
 
+SAMPLE_RATE = 16000
+WHISPER_SIZE = os.getenv("WHISPER_SIZE", "base")
+WHISPER_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Pesos int8; na GPU as ativações ficam em FP16 (int8_float16 não existe na CPU)
+WHISPER_COMPUTE_TYPE = "int8_float16" if WHISPER_DEVICE == "cuda" else "int8"
+
+# Um único worker serializa as transcrições do modelo compartilhado (o
+# CTranslate2 já paraleliza cada uma internamente) sem bloquear o event loop.
+WHISPER_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
 
 @lru_cache()
-def get_whisper_model(model_size: str = "base"):
-    logger.info("Carregando modelo Whisper (%s)...", model_size)
-    return whisper.load_model(model_size)
+def get_whisper_model(model_size: str = WHISPER_SIZE):
+    # Import tardio: o CTranslate2 só é carregado quando o modelo é pedido
+    from faster_whisper import WhisperModel
+
+    logger.info("Carregando modelo Whisper (%s, %s)...", model_size, WHISPER_COMPUTE_TYPE)
+    return WhisperModel(model_size, device=WHISPER_DEVICE, compute_type=WHISPER_COMPUTE_TYPE)
+
+
+def decode_audio(contents: bytes) -> np.ndarray:
+    """
+    Decodifica o áudio enviado (webm, ogg, mp3, wav...) com um único pipe do
+    ffmpeg para PCM mono 16 kHz em float32, formato aceito pelo Whisper.
+    """
+    cmd = [
+        "ffmpeg",
+        "-hide_banner",
+        "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", "s16le",
+        "-ac", "1",
+        "-ar", str(SAMPLE_RATE),
+        "pipe:1",
+    ]
+    process = subprocess.run(cmd, input=contents, capture_output=True)
+    if process.returncode != 0:
+        raise ValueError(
+            f"Falha ao decodificar áudio: {process.stderr.decode(errors='ignore').strip()}"
+        )
+    return np.frombuffer(process.stdout, np.int16).astype(np.float32) / 32768.0
+
+
+def transcribe(audio: np.ndarray) -> Dict[str, Any]:
+    """Transcreve o áudio; deve ser executado no WHISPER_POOL."""
+    model = get_whisper_model()
+    segments, info = model.transcribe(audio, language="pt")
+    # segments é um gerador: a decodificação acontece ao consumi-lo
+    text = "".join(segment.text for segment in segments)
+    return {"text": text, "language": info.language}
+
 
+def warm_up_whisper():
+    """
+    Carrega o modelo e transcreve 1 s de silêncio, para que a primeira
+    requisição não pague o carregamento nem a inicialização dos kernels.
+    Deve ser executado no WHISPER_POOL.
+    """
+    transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+    logger.info("Modelo Whisper (%s) pronto", WHISPER_SIZE)